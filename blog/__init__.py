@@ -2,6 +2,7 @@ import os
 
 # Import the Flask object
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 
 # Create an application instance
 app = Flask(__name__)
@@ -10,8 +11,21 @@ app = Flask(__name__)
 config_path = os.environ.get("CONFIG_PATH", "blog.config.DevelopmentConfig")
 app.config.from_object(config_path)
 
+# Keep compiled templates on disk, so a new worker loads them instead of compiling every template
+# on its first requests ("python manage.py compile_templates" fills the cache at build time)
+# Outside development, templates are never checked for changes either
+bytecode_cache_dir = app.config["JINJA_BYTECODE_CACHE_DIR"] or None
+if bytecode_cache_dir:
+    os.makedirs(bytecode_cache_dir, exist_ok=True)
+app.jinja_options = dict(app.jinja_options,
+                         bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir),
+                         auto_reload=app.config["TEMPLATES_AUTO_RELOAD"])
+
 # Imports come after app object because the views.py and filters.py will both make use of the app object
 # . is the current folder
 from . import views
 from . import filters
-from . import login
\ No newline at end of file
+from . import login
+from . import instrumentation
+from . import profiler
+from . import metrics
\ No newline at end of file
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+# A small thread-safe LRU (least recently used) cache
+# It is bounded by the number of entries and optionally by the total size of the values, and
+# counts hits and misses so you can tell from monitoring whether it's big enough
+# With a ttl, values also expire that many seconds after they were set
+class LRUCache(object):
+    def __init__(self, max_entries=1024, max_bytes=None, sizeof=len, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # sizeof works out how many bytes a value takes up (len is right for strings)
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                # Expired - leave it out of the cache
+                self._bytes -= size
+                self.misses += 1
+                return default
+            # Re-insert so the key becomes the most recently used
+            self._data[key] = (value, size, expires)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value):
+        size = self.sizeof(value)
+        # Don't let a single huge value flush everything else out of the cache
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size, expires)
+            self._bytes += size
+            # Evict from the least recently used end until we're back within the bounds
+            while (len(self._data) > self.max_entries or
+                   (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._bytes -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+    
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
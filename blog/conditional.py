@@ -0,0 +1,37 @@
+import datetime
+import hashlib
+import time
+
+from flask import request, make_response, session as http_session
+from werkzeug.http import is_resource_modified
+
+# Conditional GET support: pages carry an ETag and Last-Modified, and when the client already has
+# the current version we answer 304 Not Modified before spending any time rendering the template
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+def to_utc(value):
+    # Entry timestamps are naive local times (datetime.now), but HTTP dates are always UTC
+    return datetime.datetime.utcfromtimestamp(time.mktime(value.timetuple()))
+
+def conditional_response(etag, last_modified, render):
+    # render is only called if the client's copy is out of date
+    # A pending flash message is only shown by rendering, so those requests always get the full page
+    if "_flashes" in http_session:
+        return render()
+    
+    if last_modified is not None:
+        last_modified = to_utc(last_modified)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+    
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Pages differ for logged in users, and caches should check back with us before reusing a copy
+    response.vary.add("Cookie")
+    response.cache_control.no_cache = True
+    return response
@@ -1,22 +1,50 @@
 import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import event, func, extract, Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Session as BaseSession, sessionmaker, scoped_session, relationship, deferred
 from sqlalchemy.ext.declarative import declarative_base
+from flask import _app_ctx_stack, g, has_app_context
 from flask.ext.login import UserMixin
 
 from . import app
+from .pool import create_pooled_engine
 
 # Basic Boilerplate code for working with a database using SQLAlchemy
-# Create an engine which will talk to the database specified in config.py
-engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+# Create an engine which will talk to the database specified in config.py, with the pool settings from there too
+engine = create_pooled_engine(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
+
+# Engines for the read replicas, if any are configured - see replicas.py for how views use them
+replica_engines = [create_pooled_engine(uri, app.config) for uri in app.config["SQLALCHEMY_REPLICA_URIS"]]
 
 # Create a declarative base variable - acts like a repository for the models and will issue the create table
 # statements to build up the database's table structure
 Base = declarative_base()
 
+# A session which sends queries to the replica chosen for the current request (g.replica), if any
+# Flushes (writes) always go to the primary engine
+class RoutingSession(BaseSession):
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context():
+            replica = g.get("replica")
+            if replica is not None:
+                return replica
+        return engine
+
 # Commit and start a new session
-Session = sessionmaker(bind=engine)
-session = Session()
+Session = sessionmaker(bind=engine, class_=RoutingSession)
+
+# session is a scoped_session - a proxy to one session per Flask application context, so each request
+# (and each thread running one) gets its own session, whose identity map is thrown away afterwards
+# Code running outside an app context (scripts, tests) shares the session scoped to "no context"
+def app_context_scope():
+    return id(_app_ctx_stack.top)
+
+session = scoped_session(Session, scopefunc=app_context_scope)
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    # Close the request's session, returning its connection to the pool and freeing its objects
+    session.remove()
 
 class Entry(Base):
     __tablename__ = "entries"
@@ -24,8 +52,44 @@ class Entry(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String(1024))
     content = Column(Text)
+    # Pre-rendered Markdown for content, filled in by the views when an entry is saved
+    content_html = Column(Text)
+    # When the entry was last changed, for ETags and Last-Modified (declared before the datetime
+    # column, because that name hides the datetime module for the rest of the class body)
+    # Not indexed - it's only read from rows that are already loaded, never searched or sorted on
+    # Moved on by content_changed below, rather than onupdate, so that rewriting derived columns
+    # (manage.py render_content, reindex_search) doesn't make every entry look freshly edited
+    updated_at = Column(DateTime, default=datetime.datetime.now)
     datetime = Column(DateTime, default=datetime.datetime.now)
-    author_id = Column(Integer, ForeignKey('users.id'))
+    author_id = Column(Integer, ForeignKey('users.id'), index=True)
+    # Full-text search document for title and content, recomputed by search.py whenever either changes
+    # Only Postgres fills it in - other databases (SQLite in tests) use the fallback in search.py
+    # Deferred, so loading entries for a page doesn't also load a document about the size of the content
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
+
+# Range of the Integer id columns - bigger numbers from a URL can't even be sent to the database as a parameter
+MAX_ID = 2 ** 31 - 1
+
+# Index matching the newest-first listing order, used by both the OFFSET pages and the keyset
+# (seek) pagination in views.entries, so neither has to sort the table
+Index("ix_entries_datetime_desc_id_desc", Entry.datetime.desc(), Entry.id.desc())
+
+# GIN index, so full-text matches are looked up instead of scanning every document
+Index("ix_entries_search_vector", Entry.search_vector, postgresql_using="gin")
+
+# Changing the title or content, from the views or any other way (seed, shell, scripts), is an edit
+# Changing content any other way also marks content_html as stale, so the entry_content filter
+# renders it live until manage.py render_content catches up
+@event.listens_for(Entry.content, "set")
+def content_changed(entry, value, oldvalue, initiator):
+    if value != oldvalue:
+        entry.content_html = None
+        entry.updated_at = datetime.datetime.now()
+
+@event.listens_for(Entry.title, "set")
+def title_changed(entry, value, oldvalue, initiator):
+    if value != oldvalue:
+        entry.updated_at = datetime.datetime.now()
 
 # User model to create a login system
 class User(Base, UserMixin):
@@ -37,6 +101,73 @@ class User(Base, UserMixin):
     password = Column(String(128))
     entries = relationship("Entry", backref="author")
 
-# Construct the table in the database
+# Maintained counters, so that pages don't need a COUNT(*) over a whole table on every request
+# The row is adjusted in the same transaction as the write it counts, and manage.py reconcile_counts
+# recomputes it from scratch if it ever drifts
+class Counter(Base):
+    __tablename__ = "counters"
+    
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+ENTRY_COUNT = "entries"
+
+def entry_count():
+    # Read the column directly rather than with query.get(), so a stale object in the identity map is never used
+    value = session.query(Counter.value).filter_by(name=ENTRY_COUNT).scalar()
+    if value is None:
+        # Not reconciled yet - fall back to counting, without writing from a read-only page
+        return session.query(Entry).count()
+    return value
+
+def adjust_entry_count(delta):
+    # Called by the views before they commit, so the counter moves with the entry it counts
+    updated = session.query(Counter).filter_by(name=ENTRY_COUNT).update(
+        {Counter.value: Counter.value + delta}, synchronize_session=False)
+    if not updated:
+        reconcile_entry_count()
+
+def reconcile_entry_count():
+    # Recount entries (including any pending in this session) and store the result
+    count = session.query(Entry).count()
+    session.merge(Counter(name=ENTRY_COUNT, value=count))
+    return count
+
+# Summary of how many entries were written each month, for the archive page
+# Kept up to date by the views as entries are added and deleted; manage.py rebuild_archive recomputes it
+class EntryMonth(Base):
+    __tablename__ = "entry_months"
+    
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    entry_count = Column(Integer, nullable=False, default=0)
+
+def month_range(year, month):
+    # First moment of the month, and first moment of the next one
+    start = datetime.datetime(year, month, 1)
+    if month == 12:
+        return start, datetime.datetime(year + 1, 1, 1)
+    return start, datetime.datetime(year, month + 1, 1)
+
+def adjust_month_count(when, delta):
+    # Called by the views before they commit, like adjust_entry_count
+    updated = session.query(EntryMonth).filter_by(year=when.year, month=when.month).update(
+        {EntryMonth.entry_count: EntryMonth.entry_count + delta}, synchronize_session=False)
+    if not updated:
+        # First entry of the month (or a month from before the summary existed) - count it from scratch
+        start, end = month_range(when.year, when.month)
+        count = session.query(Entry).filter(Entry.datetime >= start, Entry.datetime < end).count()
+        session.merge(EntryMonth(year=when.year, month=when.month, entry_count=count))
+
+def rebuild_month_counts():
+    # Recompute the whole summary from the entries table
+    year = extract("year", Entry.datetime)
+    month = extract("month", Entry.datetime)
+    rows = session.query(year, month, func.count(Entry.id)).group_by(year, month).all()
+    session.query(EntryMonth).delete(synchronize_session=False)
+    for year, month, count in rows:
+        session.add(EntryMonth(year=int(year), month=int(month), entry_count=count))
+    return len(rows)
 
-Base.metadata.create_all(engine)
\ No newline at end of file
+# The tables aren't created here - importing the app does no database I/O at all
+# Run "python manage.py create_db" for a new database, or "python manage.py db upgrade" for an existing one
\ No newline at end of file
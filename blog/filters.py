@@ -1,15 +1,70 @@
+import hashlib
+import threading
+
 from . import app
+from .cache import LRUCache
+from .conditional import to_utc
 from flask import Markup
 import mistune as md
 
+# Rendered HTML keyed by a hash of the Markdown, so hot entries are only parsed once per process
+# markdown_cache.stats() gives the hit/miss counters for monitoring
+markdown_cache = LRUCache(max_entries=app.config["MARKDOWN_CACHE_MAX_ENTRIES"],
+                          max_bytes=app.config["MARKDOWN_CACHE_MAX_BYTES"])
+
+# A mistune.Markdown instance keeps parser state while it works, so each thread gets its own to reuse
+_renderers = threading.local()
+
+def render_markdown(text):
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    html = markdown_cache.get(key)
+    if html is None:
+        renderer = getattr(_renderers, "markdown", None)
+        if renderer is None:
+            renderer = _renderers.markdown = md.Markdown(escape=True) ### Question - whats escape=True?
+        html = renderer(text)
+        markdown_cache.set(key, html)
+    return html
+
 @app.template_filter()
 def markdown(text):
-    return Markup(md.markdown(text,escape=True)) ### Question - whats escape=True?
+    return Markup(render_markdown(text))
+
+# Entries store the HTML rendered when they were saved, so pages don't re-parse Markdown on every view
+# content_html is None when it's stale (content changed outside the views), and then it's rendered live
+@app.template_filter()
+def entry_content(entry):
+    if entry.content_html is None:
+        return markdown(entry.content)
+    return Markup(entry.content_html)
 
 # Markdown is a text-to-HTML conversion tool
 # Markup marks a variable you trust to be "safe" in HTML format
 # mistune - markdown parser with render features
 
+# Rendered render_entry macro output, keyed by entry id and last change, so a page of entries is mostly
+# joining together fragments rendered earlier - used in templates as {{ render_entry_fragment(entry) }}
+fragment_cache = LRUCache(max_entries=app.config["FRAGMENT_CACHE_MAX_ENTRIES"],
+                          max_bytes=app.config["FRAGMENT_CACHE_MAX_BYTES"])
+
+@app.template_global()
+def render_entry_fragment(entry):
+    author = entry.author
+    key = (entry.id, entry.updated_at or entry.datetime,
+           author.id if author else None, author.name if author else None)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = app.jinja_env.get_template("macros.html").module.render_entry(entry)
+        fragment_cache.set(key, str(html))
+    return Markup(html)
+
+# Entry timestamps are naive local times - feeds need them in UTC
+@app.template_filter()
+def utc(date):
+    if not date:
+        return None
+    return to_utc(date)
+
 @app.template_filter()
 def dateformat(date, format):
     if not date:
@@ -0,0 +1,59 @@
+import json
+import logging
+import time
+
+from flask import g, request, has_app_context
+from sqlalchemy import event
+
+from . import app
+from .database import engine, replica_engines
+
+# Counts the SQL statements each request runs and the time spent in them, on the primary and any replicas
+# The totals go out in a Server-Timing header (shown by the browser's developer tools) and in one
+# JSON log line per request; statements slower than SLOW_QUERY_THRESHOLD_MS are logged with their SQL
+# Streamed pages run most of their queries after the headers are sent, so only the log line has those
+
+logger = logging.getLogger(__name__)
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        # A stack, in case a statement runs another one on the same connection
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if has_app_context():
+            g.query_count = g.get("query_count", 0) + 1
+            g.query_time = g.get("query_time", 0.0) + elapsed
+        threshold = app.config["SLOW_QUERY_THRESHOLD_MS"]
+        if threshold is not None and elapsed * 1000 >= threshold:
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+for instrumented in [engine] + replica_engines:
+    instrument_engine(instrumented)
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.query_count = 0
+    g.query_time = 0.0
+
+@app.after_request
+def add_timing(response):
+    total = time.perf_counter() - g.get("request_start", time.perf_counter())
+    queries = g.get("query_count", 0)
+    db_time = g.get("query_time", 0.0)
+    response.headers["Server-Timing"] = 'db;dur={:.1f};desc="{} queries", total;dur={:.1f}'.format(
+        db_time * 1000, queries, total * 1000)
+    logger.info(json.dumps({
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "queries": queries,
+        "db_ms": round(db_time * 1000, 1),
+        "total_ms": round(total * 1000, 1)
+    }))
+    return response
@@ -1,7 +1,9 @@
 from . import app
 from flask.ext.login import LoginManager
+from sqlalchemy.orm import make_transient_to_detached
 
 from .database import session, User # Question - why is there a dot in front of the database
+from .cache import LRUCache
 
 # Create an instance of the LoginManager and initialize it
 login_manager = LoginManager()
@@ -14,7 +16,27 @@ login_manager.login_view = "login_get"
 # Used in conjunction with Bootstrap's alerts system to give the user information about the login process
 login_manager.login_message_category = "danger"
 
+# The few fields pages need from the logged in user, so most requests don't load it from the database
+# Each process has its own cache, so a change made elsewhere (manage.py, another worker) shows up
+# within USER_CACHE_TTL seconds; code changing a user in this process calls invalidate_user
+user_cache = LRUCache(max_entries=app.config["USER_CACHE_MAX_ENTRIES"], ttl=app.config["USER_CACHE_TTL"])
+
+def invalidate_user(id):
+    user_cache.delete(int(id))
+
 @login_manager.user_loader
 def load_user(id):
-    return session.query(User).get(int(id))
+    fields = user_cache.get(int(id))
+    if fields is None:
+        user = session.query(User).get(int(id))
+        if user is not None:
+            user_cache.set(user.id, (user.id, user.name, user.email))
+        return user
+    
+    # Rebuild the user and attach it to this request's session without a SELECT - anything not
+    # cached (the password) is loaded if it's ever used
+    user_id, name, email = fields
+    user = User(id=user_id, name=name, email=email)
+    make_transient_to_detached(user)
+    return session.merge(user, load=False)
 
@@ -0,0 +1,99 @@
+import os
+import time
+
+from flask import g, request, Response
+from jinja2 import Template
+
+from . import app
+
+# Prometheus metrics, served at /metrics
+# With several worker processes, each one writes its metrics to files in METRICS_DIR and /metrics adds
+# them all up - prometheus_client reads the directory from the environment when it's first imported,
+# so it's set here before the import (the directory should be emptied when the server starts, and a
+# gunicorn child_exit hook should call prometheus_client.multiprocess.mark_process_dead(worker.pid))
+# The endpoint should only be reachable by the Prometheus server - restrict it at the proxy
+if app.config["METRICS_DIR"]:
+    os.makedirs(app.config["METRICS_DIR"], exist_ok=True)
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", app.config["METRICS_DIR"])
+    # The name older versions of prometheus_client look for
+    os.environ.setdefault("prometheus_multiproc_dir", app.config["METRICS_DIR"])
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+
+from .database import engine, replica_engines
+from .pool import pool_stats
+from .filters import markdown_cache, fragment_cache
+
+REQUESTS = Counter("blogful_requests_total", "Requests handled", ["method", "endpoint", "status"])
+# Streamed pages are timed until their headers are sent, not until the last entry is rendered
+LATENCY = Histogram("blogful_request_duration_seconds", "Time to handle a request", ["method", "endpoint"])
+TEMPLATE_TIME = Histogram("blogful_template_render_seconds", "Time to render a template", ["template"])
+# Gauges are reported by every live process - pool figures per process, cache figures added together
+POOL = Gauge("blogful_db_pool", "Connection pool statistics (see pool.py)", ["engine", "stat"],
+             multiprocess_mode="liveall")
+CACHE = Gauge("blogful_cache", "In-process cache statistics (see cache.py)", ["cache", "stat"],
+              multiprocess_mode="livesum")
+
+def update_gauges():
+    # Set from each request, so every process's files are current whichever process serves /metrics
+    engines = [("primary", engine)] + [("replica{}".format(i), replica) for i, replica in enumerate(replica_engines)]
+    for name, pooled in engines:
+        stats = pool_stats(pooled)
+        if stats is None:
+            continue
+        for stat in ("checked_out", "overflow", "saturation", "checkouts", "checkout_wait_total", "checkout_wait_max"):
+            POOL.labels(name, stat).set(stats[stat])
+    for name, cache in (("markdown", markdown_cache), ("fragment", fragment_cache)):
+        stats = cache.stats()
+        for stat in ("entries", "bytes", "hits", "misses", "evictions"):
+            CACHE.labels(name, stat).set(stats[stat])
+
+def record_request(status):
+    # request_start is set by instrumentation.py
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+    endpoint = request.endpoint or "none"
+    REQUESTS.labels(request.method, endpoint, status).inc()
+    LATENCY.labels(request.method, endpoint).observe(elapsed)
+    update_gauges()
+    g.request_recorded = True
+
+@app.after_request
+def record_response(response):
+    record_request(response.status_code)
+    return response
+
+# after_request functions don't run when a view raises an exception, so count those 500s here
+@app.teardown_request
+def record_failed_request(exception=None):
+    if exception is not None and not g.get("request_recorded"):
+        record_request(500)
+
+# Templates time their own rendering - Flask 0.10 has no signal before a template renders
+# Streamed templates (views.stream_entries) are timed until their last piece is generated
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            TEMPLATE_TIME.labels(self.name or "string").observe(time.perf_counter() - start)
+    
+    def generate(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            for piece in Template.generate(self, *args, **kwargs):
+                yield piece
+        finally:
+            TEMPLATE_TIME.labels(self.name or "string").observe(time.perf_counter() - start)
+
+app.jinja_env.template_class = TimedTemplate
+
+@app.route("/metrics")
+def metrics():
+    if app.config["METRICS_DIR"]:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
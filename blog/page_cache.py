@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import stat
+import time
+from functools import wraps
+
+from flask import g, request, make_response, request_finished, session as http_session
+from flask.ext.login import current_user
+
+from . import app
+from .cache import LRUCache
+from .replicas import use_primary
+
+# Whole-page cache for anonymous visitors, who all get the same HTML for the same URL
+# A page is stored as a dict of status, content type and body, and expires after a TTL
+# Every write to the entries clears it, see invalidate_pages()
+
+class MemoryPageCache(object):
+    # Pages kept in this process only - each worker process has its own copy
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.pages = LRUCache(max_entries=max_entries, sizeof=lambda item: len(item[1]["body"]))
+    
+    def get(self, key):
+        item = self.pages.get(key)
+        if item is None:
+            return None
+        expires, page = item
+        if expires is not None and expires < time.time():
+            self.pages.delete(key)
+            return None
+        return page
+    
+    def set(self, key, page):
+        expires = time.time() + self.ttl if self.ttl else None
+        self.pages.set(key, (expires, page))
+    
+    def clear(self):
+        self.pages.clear()
+
+class FileSystemPageCache(object):
+    # Pages kept as files in a directory, so every worker process on the machine shares them
+    # and clearing the cache after a write reaches all of them
+    # A file is one line of JSON (status, content type, headers) followed by the body - nothing in it
+    # is ever executed, and the directory has to be private to this user, so nobody else can plant pages
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory)
+    
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".page")
+    
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, "rb") as f:
+                page = json.loads(f.readline().decode("utf-8"))
+                page["body"] = f.read()
+        except (OSError, ValueError):
+            return None
+        if "headers" in page:
+            page["headers"] = [tuple(header) for header in page["headers"]]
+        return page
+    
+    def set(self, key, page):
+        # Write to a temporary file and rename it into place, so readers never see half a page
+        path = self.path(key)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        header = dict((name, value) for name, value in page.items() if name != "body")
+        with open(temp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(page["body"])
+        os.replace(temp_path, path)
+    
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".page"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+def check_private(directory):
+    # The cache directory must be a real directory owned by us, which no one else can write to
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or
+            (hasattr(os, "getuid") and info.st_uid != os.getuid())):
+        raise ValueError("{} must be a directory only this user can write to".format(directory))
+
+def page_cache_dir(config):
+    # Defaults to the app's instance folder, rather than somewhere shared like /tmp
+    return config["PAGE_CACHE_DIR"] or os.path.join(app.instance_path, "page-cache")
+
+def make_page_cache(config):
+    backend = config["PAGE_CACHE_BACKEND"]
+    if backend == "memory":
+        return MemoryPageCache(config["PAGE_CACHE_TTL"], config["PAGE_CACHE_MAX_ENTRIES"])
+    if backend == "filesystem":
+        return FileSystemPageCache(page_cache_dir(config), config["PAGE_CACHE_TTL"])
+    if backend:
+        raise ValueError("Unknown PAGE_CACHE_BACKEND {!r}".format(backend))
+    return None
+
+page_cache = make_page_cache(app.config)
+
+def make_feed_cache(config):
+    # Feeds look the same to everyone, so they're always cached, until the next write clears them
+    # Other worker processes only see that clear if they share the filesystem backend - otherwise
+    # FEED_CACHE_TTL bounds how long they can serve an old feed
+    if config["PAGE_CACHE_BACKEND"] == "filesystem":
+        return FileSystemPageCache(os.path.join(page_cache_dir(config), "feeds"), config["FEED_CACHE_TTL"])
+    return MemoryPageCache(config["FEED_CACHE_TTL"], max_entries=10)
+
+feed_cache = make_feed_cache(app.config)
+
+# Response headers kept with a cached page, so cache hits still support conditional GET
+CACHED_HEADERS = ("ETag", "Last-Modified", "Cache-Control", "Vary")
+
+def invalidate_pages():
+    # Called by the views after they commit a change to the entries
+    if page_cache is not None:
+        page_cache.clear()
+    feed_cache.clear()
+
+# Decorator for views whose page only depends on the URL path and the query arguments listed in vary_on
+# shared=True is for pages which are the same for everyone, logged in or not (the feeds) - they go in feed_cache
+def cached_page(vary_on=(), shared=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = feed_cache if shared else page_cache
+            if cache is None or request.method != "GET":
+                return view(*args, **kwargs)
+            # Logged in users (and anyone with a flashed message waiting) get a freshly rendered page
+            if not shared and (current_user.is_authenticated or "_flashes" in http_session):
+                return view(*args, **kwargs)
+            
+            # The feeds' links are absolute, built from the Host the request came in on, so the host is part
+            # of the key - otherwise one request with a forged Host header would poison the page for everyone
+            key = "|".join([request.url_root, request.path, "everyone" if shared else "anonymous"] +
+                           ["{}={}".format(name, request.args.get(name, "")) for name in vary_on])
+            page = cache.get(key)
+            if page is not None:
+                response = app.response_class(page["body"], status=page["status"], content_type=page["content_type"])
+                response.headers.extend(page["headers"])
+                # Still answer 304 if the visitor's copy matches the cached ETag/Last-Modified
+                return response.make_conditional(request)
+            
+            # Pages going into the cache are read from the primary - a replica which hasn't caught up
+            # with the write that just cleared the cache would put the old page straight back
+            use_primary()
+            response = make_response(view(*args, **kwargs))
+            # Stored by store_page once the response is finished - only then does it have its cookies
+            g.cached_page = (cache, key)
+            return response
+        return wrapper
+    return decorator
+
+# Sent after the after_request functions and the session have added their headers, so a response
+# setting a cookie is seen here (needs blinker - without it nothing is ever stored)
+@request_finished.connect_via(app)
+def store_page(sender, response, **extra):
+    fill = g.get("cached_page")
+    if fill is None:
+        return
+    g.cached_page = None
+    cache, key = fill
+    # Only plain successful pages are stored - never error pages, redirects or anything setting a cookie
+    if response.status_code == 200 and not response.is_streamed and "Set-Cookie" not in response.headers:
+        cache.set(key, {
+            "status": response.status_code,
+            "content_type": response.content_type,
+            "headers": [(name, value) for name, value in response.headers if name in CACHED_HEADERS],
+            "body": response.get_data()
+        })
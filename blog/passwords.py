@@ -0,0 +1,96 @@
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from . import app
+from .cache import LRUCache
+
+# Password hashing for logins and new users
+# Hashing is deliberately slow and CPU bound, so it runs in a small pool of separate processes: the
+# request thread waits for it without holding the GIL, and other requests in the worker keep running
+# At most PASSWORD_HASH_QUEUE hashes per worker process can be waiting or running - anything more
+# raises HashingBusy (the login view answers 503) instead of piling up behind a burst of logins
+# PASSWORD_HASH_WORKERS = 0 hashes in the calling thread instead (scripts, tests)
+
+class HashingBusy(Exception):
+    pass
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(app.config["PASSWORD_HASH_QUEUE"])
+
+def get_pool():
+    # Started on first use, so each worker process (after the server forks) has its own
+    # That first use is a request thread, and forking a process that has other threads running copies
+    # any locks they hold - so the hashing processes are spawned fresh where Python lets us choose
+    # (3.7 and later); on older Pythons, run servers with one thread per process, or start the pool
+    # from a post-fork hook (e.g. gunicorn's post_fork calling passwords.get_pool)
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if sys.version_info >= (3, 7):
+                _pool = ProcessPoolExecutor(max_workers=app.config["PASSWORD_HASH_WORKERS"],
+                                            mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _pool = ProcessPoolExecutor(max_workers=app.config["PASSWORD_HASH_WORKERS"])
+        return _pool
+
+def discard_pool(pool):
+    # A pool whose process died is broken for good - the next hash starts a new one
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+def run(function, *args, **kwargs):
+    if not app.config["PASSWORD_HASH_WORKERS"]:
+        return function(*args, **kwargs)
+    if not _slots.acquire(timeout=app.config["PASSWORD_HASH_TIMEOUT"]):
+        raise HashingBusy()
+    try:
+        pool = get_pool()
+        future = pool.submit(function, *args, **kwargs)
+        return future.result(timeout=app.config["PASSWORD_HASH_TIMEOUT"])
+    except TimeoutError:
+        # Don't hold the slot (or the request) for a hash that's stuck - drop it if it hasn't started
+        future.cancel()
+        raise HashingBusy()
+    except BrokenProcessPool:
+        discard_pool(pool)
+        raise HashingBusy()
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    return run(generate_password_hash, password, method=app.config["PASSWORD_HASH_METHOD"])
+
+def check_password(pwhash, password):
+    return run(check_password_hash, pwhash, password)
+
+def needs_rehash(pwhash):
+    # Hashes start with the method they were made with, e.g. "pbkdf2:sha256:150000$salt$hash"
+    return pwhash.split("$", 1)[0] != app.config["PASSWORD_HASH_METHOD"]
+
+# Failed logins in the last LOGIN_RATE_WINDOW seconds, per address and per email address
+# Once either reaches LOGIN_RATE_LIMIT, logins are refused without checking (or hashing) the password
+# Counts are kept per worker process, so the real limit is LOGIN_RATE_LIMIT times the number of processes
+failed_logins = LRUCache(max_entries=10000, ttl=app.config["LOGIN_RATE_WINDOW"])
+
+def recent_failures(key):
+    cutoff = time.monotonic() - app.config["LOGIN_RATE_WINDOW"]
+    return [when for when in failed_logins.get(key, ()) if when > cutoff]
+
+def login_allowed(address, email):
+    limit = app.config["LOGIN_RATE_LIMIT"]
+    return (len(recent_failures(("address", address))) < limit and
+            len(recent_failures(("email", email.lower()))) < limit)
+
+def login_failed(address, email):
+    for key in (("address", address), ("email", email.lower())):
+        failed_logins.set(key, tuple(recent_failures(key)) + (time.monotonic(),))
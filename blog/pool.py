@@ -0,0 +1,85 @@
+import threading
+import time
+
+from sqlalchemy import create_engine, event, exc, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+# A QueuePool which records how long each checkout took (waiting for a free connection, or opening one)
+# If checkouts start waiting, the pool is too small for the number of threads/workers using it
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+    
+    def stats(self):
+        # Saturation is the fraction of all possible connections (pool + overflow) in use right now
+        capacity = self.size() + max(self._max_overflow, 0)
+        checked_out = self.checkedout()
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": checked_out,
+                "overflow": max(self.overflow(), 0),
+                "saturation": checked_out / capacity if capacity else 0.0,
+                "checkouts": self.checkouts,
+                "checkout_wait_total": self.wait_total,
+                "checkout_wait_max": self.wait_max
+            }
+
+def add_pre_ping(engine):
+    # Test each connection with a cheap SELECT 1 when it's checked out, so connections the database
+    # (or a firewall) closed while they sat in the pool are replaced instead of failing the request
+    @event.listens_for(engine, "engine_connect")
+    def ping_connection(connection, branch):
+        if branch:
+            # A "branch" shares its parent's connection, which has already been checked
+            return
+        save_should_close_with_result = connection.should_close_with_result
+        connection.should_close_with_result = False
+        try:
+            connection.scalar(select([1]))
+        except exc.DBAPIError as error:
+            # The pool invalidates the dead connection; running the statement again reconnects
+            if error.connection_invalidated:
+                connection.scalar(select([1]))
+            else:
+                raise
+        finally:
+            connection.should_close_with_result = save_should_close_with_result
+
+def create_pooled_engine(uri, config):
+    # Build an engine using the pool settings from config.py
+    if make_url(uri).drivername.startswith("sqlite"):
+        # SQLite uses its own single-connection pools, which don't take these settings
+        return create_engine(uri)
+    engine = create_engine(uri,
+                           poolclass=TimedQueuePool,
+                           pool_size=config["SQLALCHEMY_POOL_SIZE"],
+                           max_overflow=config["SQLALCHEMY_MAX_OVERFLOW"],
+                           pool_timeout=config["SQLALCHEMY_POOL_TIMEOUT"],
+                           pool_recycle=config["SQLALCHEMY_POOL_RECYCLE"])
+    if config["SQLALCHEMY_POOL_PRE_PING"]:
+        add_pre_ping(engine)
+    return engine
+
+def pool_stats(engine):
+    # Checkout wait time and saturation of an engine's pool, or None if it isn't one of ours
+    if not isinstance(engine.pool, TimedQueuePool):
+        return None
+    return engine.pool.stats()
@@ -0,0 +1,99 @@
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import time
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.urls import url_decode, url_encode
+
+from . import app
+from .page_cache import check_private
+
+# Opt-in profiling of whole requests (the view, its queries, the templates and their filters)
+# - PROFILE in the config profiles every request and writes a .prof file per request to PROFILE_DIR,
+#   to be read with pstats or a viewer like snakeviz
+# - ?profile=<token> profiles one request and returns the PROFILE_RESTRICTIONS slowest functions
+#   (by cumulative time) as text instead of the page; "python manage.py profile_token" makes a token
+# The token is signed with SECRET_KEY and expires, so only admins can profile on production
+# Cached pages are served from the page cache - profile those with it turned off, or with a new ?limit=
+
+TOKEN_SALT = "blogful-profile"
+
+def make_profile_token():
+    return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt=TOKEN_SALT).dumps("profile")
+
+def valid_profile_token(token):
+    serializer = URLSafeTimedSerializer(app.config["SECRET_KEY"], salt=TOKEN_SALT)
+    try:
+        # Expired tokens raise SignatureExpired, a kind of BadSignature
+        serializer.loads(token, max_age=app.config["PROFILE_TOKEN_MAX_AGE"])
+    except BadSignature:
+        return False
+    return True
+
+class ProfilerMiddleware(object):
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        args = url_decode(environ.get("QUERY_STRING", ""))
+        summary = "profile" in args and valid_profile_token(args["profile"])
+        if not summary and not app.config["PROFILE"]:
+            return self.wsgi_app(environ, start_response)
+
+        if summary:
+            # The view sees the request without the token
+            args.poplist("profile")
+            environ["QUERY_STRING"] = url_encode(args)
+
+        # Run the app and read its whole body inside the profiler, so streamed pages are profiled too
+        response = []
+        body = []
+        def capture_start_response(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return body.append
+        def run_app():
+            app_iter = self.wsgi_app(environ, capture_start_response)
+            try:
+                body.extend(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.runcall(run_app)
+        elapsed = time.perf_counter() - start
+
+        if summary:
+            output = io.StringIO()
+            stats = pstats.Stats(profile, stream=output)
+            stats.sort_stats("cumulative").print_stats(app.config["PROFILE_RESTRICTIONS"])
+            text = "{} {} - {} in {:.1f} ms\n\n{}".format(environ["REQUEST_METHOD"], environ.get("PATH_INFO", "/"),
+                                                        response[0], elapsed * 1000, output.getvalue())
+            start_response("200 OK", [("Content-Type", "text/plain; charset=utf-8"),
+                                      ("Cache-Control", "no-store")])
+            return [text.encode("utf-8")]
+
+        self.save(profile, environ, elapsed)
+        start_response(*response)
+        return body
+
+    def save(self, profile, environ, elapsed):
+        # One file per request, named like GET.entry.3.12ms.1466000000.4242-7.prof - the process id and
+        # a counter keep requests finishing in the same second from overwriting each other
+        directory = app.config["PROFILE_DIR"] or os.path.join(app.instance_path, "profiles")
+        # Like the page cache, only a directory no one else can write to (or plant links in)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory)
+        path = environ.get("PATH_INFO", "/").strip("/").replace("/", ".") or "root"
+        name = "{}.{}.{:.0f}ms.{:.0f}.{}-{}.prof".format(environ["REQUEST_METHOD"], path, elapsed * 1000,
+                                                          time.time(), os.getpid(), next(_saved))
+        profile.dump_stats(os.path.join(directory, name))
+
+# Numbers the files this process writes
+_saved = itertools.count()
+
+app.wsgi_app = ProfilerMiddleware(app.wsgi_app)
@@ -0,0 +1,57 @@
+import itertools
+import logging
+import time
+from functools import wraps
+
+from flask import g, session as http_session
+from sqlalchemy.exc import OperationalError
+
+from . import app
+from .database import session, replica_engines
+
+logger = logging.getLogger(__name__)
+
+# Round-robin position, and when each failed replica may be tried again
+_next_replica = itertools.count()
+_failed_until = {}
+
+def choose_replica():
+    # Pick the next replica that hasn't failed recently, or None to use the primary
+    now = time.time()
+    healthy = [replica for replica in replica_engines if _failed_until.get(replica, 0) <= now]
+    if not healthy:
+        return None
+    return healthy[next(_next_replica) % len(healthy)]
+
+def mark_write():
+    # Remember (in the user's cookie) when they last wrote, for read-your-writes
+    http_session["last_write"] = time.time()
+
+def use_primary():
+    # Send the rest of this request's reads to the primary, even from read_only views
+    g.primary_only = True
+
+def recently_wrote():
+    last_write = http_session.get("last_write", 0)
+    return time.time() - last_write < app.config["READ_YOUR_WRITES_SECONDS"]
+
+# Decorator for views which only read - their queries go to a replica when one is available
+# If the replica can't be reached, it's skipped for a while and the view runs again on the primary
+def read_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not replica_engines or recently_wrote() or g.get("primary_only"):
+            return view(*args, **kwargs)
+        
+        g.replica = choose_replica()
+        if g.replica is None:
+            return view(*args, **kwargs)
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            logger.warning("Replica %s failed, falling back to the primary", g.replica.url, exc_info=True)
+            _failed_until[g.replica] = time.time() + app.config["REPLICA_RETRY_AFTER"]
+            session.rollback()
+            g.replica = None
+            return view(*args, **kwargs)
+    return wrapper
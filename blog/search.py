@@ -0,0 +1,153 @@
+import re
+import threading
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import event, func, cast, tuple_, Numeric
+from sqlalchemy.orm.attributes import get_history
+
+from . import app
+from .database import MAX_ID, session, engine, Entry, User
+
+# Full-text search over entry titles and content
+# On Postgres each entry keeps a tsvector (search_vector) with a GIN index, ranked with ts_rank
+# Other databases (SQLite in the tests) use a pure-Python inverted index built from the entries table
+
+def use_postgres():
+    return engine.dialect.name == "postgresql"
+
+def index_entry(entry):
+    # Assigning a SQL expression makes Postgres compute the tsvector as the row is written
+    document = "{} {}".format(entry.title or "", entry.content or "")
+    entry.search_vector = func.to_tsvector(app.config["SEARCH_LANGUAGE"], document)
+
+# Index every entry as it's written, however it was changed (views, seed, the shell, scripts), the
+# same way database.content_changed keeps content_html from going stale
+@event.listens_for(Entry, "before_insert")
+def index_new_entry(mapper, connection, entry):
+    if use_postgres():
+        index_entry(entry)
+
+@event.listens_for(Entry, "before_update")
+def index_changed_entry(mapper, connection, entry):
+    if use_postgres() and (get_history(entry, "title").has_changes() or
+                           get_history(entry, "content").has_changes()):
+        index_entry(entry)
+
+def reindex_entries():
+    # Recompute every entry's tsvector, after SEARCH_LANGUAGE changes - returns how many were updated
+    if not use_postgres():
+        return 0
+    document = func.coalesce(Entry.title, "") + " " + func.coalesce(Entry.content, "")
+    return session.query(Entry).update(
+        {Entry.search_vector: func.to_tsvector(app.config["SEARCH_LANGUAGE"], document)},
+        synchronize_session=False)
+
+def entries_changed():
+    # Called after a commit which added, edited or deleted entries - the fallback index is rebuilt
+    # from the table on the next search
+    fallback_index.clear()
+
+# Words are runs of letters and digits, compared in lower case
+WORD = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    return WORD.findall((text or "").lower())
+
+class InvertedIndex(object):
+    def __init__(self):
+        # word -> {entry id: number of times the word appears in the entry}
+        self.postings = {}
+        self.built = False
+        self.lock = threading.Lock()
+    
+    def add(self, eid, text):
+        for word in tokenize(text):
+            entries = self.postings.setdefault(word, {})
+            entries[eid] = entries.get(eid, 0) + 1
+    
+    def clear(self):
+        with self.lock:
+            self.postings = {}
+            self.built = False
+    
+    def build(self):
+        # Load every entry once; later searches only touch the postings of the words searched for
+        with self.lock:
+            if self.built:
+                return
+            for eid, title, content in session.query(Entry.id, Entry.title, Entry.content):
+                self.add(eid, "{} {}".format(title or "", content or ""))
+            self.built = True
+    
+    def search(self, query):
+        # Entries containing every word of the query, as (score, id) pairs, best first
+        # The score adds up how often each word appears, like a (very) simple ts_rank
+        words = set(tokenize(query))
+        if not words:
+            return []
+        postings = [self.postings.get(word, {}) for word in words]
+        matches = set.intersection(*[set(entries) for entries in postings])
+        results = [(float(sum(entries[eid] for entries in postings)), eid) for eid in matches]
+        return sorted(results, reverse=True)
+
+fallback_index = InvertedIndex()
+
+def format_cursor(rank, eid):
+    return "{},{}".format(rank, eid)
+
+def parse_cursor(value):
+    # Raises ValueError for anything that isn't "<rank>,<id>" - including NaN and Infinity, which
+    # Decimal accepts but can't be compared with the ranks
+    rank, eid = value.rsplit(",", 1)
+    try:
+        rank = Decimal(rank)
+    except InvalidOperation:
+        raise ValueError(value)
+    eid = int(eid)
+    if not rank.is_finite() or not -MAX_ID - 1 <= eid <= MAX_ID:
+        raise ValueError(value)
+    return rank, eid
+
+def search_entries(query, limit, before=None):
+    # Returns (results, has_next), where each result has id, title, datetime, author and rank
+    # Results are ordered by (rank, id), both descending, and paginated with a keyset cursor on them
+    if use_postgres():
+        return search_postgres(query, limit, before)
+    return search_fallback(query, limit, before)
+
+def search_postgres(query, limit, before):
+    tsquery = func.plainto_tsquery(app.config["SEARCH_LANGUAGE"], query)
+    # ts_rank is a single precision float, which doesn't survive the round trip through a cursor
+    # in the URL - rounding it to an exact decimal means the next page starts exactly where this one ended
+    rank = func.round(cast(func.ts_rank(Entry.search_vector, tsquery), Numeric), 6)
+    rows = session.query(Entry.id, Entry.title, Entry.datetime, User.name.label("author"), rank.label("rank"))
+    rows = rows.outerjoin(User, Entry.author_id == User.id)
+    rows = rows.filter(Entry.search_vector.op("@@")(tsquery))
+    if before is not None:
+        rows = rows.filter(tuple_(rank, Entry.id) < before)
+    rows = rows.order_by(rank.desc(), Entry.id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+def search_fallback(query, limit, before):
+    fallback_index.build()
+    matches = fallback_index.search(query)
+    if before is not None:
+        matches = [match for match in matches if match < before]
+    page = matches[:limit]
+    ranks = dict((eid, rank) for rank, eid in page)
+    
+    rows = session.query(Entry.id, Entry.title, Entry.datetime, User.name.label("author"))
+    rows = rows.outerjoin(User, Entry.author_id == User.id)
+    rows = rows.filter(Entry.id.in_(list(ranks))).all() if ranks else []
+    # Give the rows the same shape as the Postgres results, in rank order
+    results = [SearchResult(row.id, row.title, row.datetime, row.author, ranks[row.id]) for row in rows]
+    results.sort(key=lambda result: (result.rank, result.id), reverse=True)
+    return results, len(matches) > limit
+
+class SearchResult(object):
+    def __init__(self, id, title, datetime, author, rank):
+        self.id = id
+        self.title = title
+        self.datetime = datetime
+        self.author = author
+        self.rank = rank
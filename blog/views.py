@@ -1,28 +1,216 @@
-from flask import render_template, request, redirect, url_for, flash
+import datetime
+
+from flask import render_template, request, redirect, url_for, flash, abort, stream_with_context
 from flask.ext.login import login_user, login_required, current_user, logout_user
-from werkzeug.security import check_password_hash
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
 from werkzeug.exceptions import Forbidden
 
 from . import app
-from .database import session, Entry, User
+from .database import MAX_ID, session, Entry, User, EntryMonth, entry_count, adjust_entry_count, adjust_month_count, month_range
+from .filters import render_markdown
+from .replicas import read_only, mark_write
+from .page_cache import cached_page, invalidate_pages
+from .conditional import make_etag, conditional_response
+from . import search as full_text
+from . import passwords
 
 # How many entries per page (FYI, ALL_UPPERCASE_NAME is constant, by convention)
 PAGINATE_BY = 10
 
+# Format of the keyset pagination cursor, e.g. ?before=2016-05-23T11:38:21.783680,42
+CURSOR_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+def format_cursor(entry):
+    # A cursor is the (datetime, id) pair of an entry, which is unique and matches the sort order
+    return "{},{}".format(entry.datetime.strftime(CURSOR_FORMAT), entry.id)
+
+def parse_cursor(value):
+    # Turn "<datetime>,<id>" back into a (datetime, id) tuple, or give a 400 for garbage
+    try:
+        timestamp, eid = value.rsplit(",", 1)
+        cursor = datetime.datetime.strptime(timestamp, CURSOR_FORMAT), int(eid)
+    except ValueError:
+        abort(400)
+    if not -MAX_ID - 1 <= cursor[1] <= MAX_ID:
+        abort(400)
+    return cursor
+
+def parse_limit(args):
+    # ?limit= must be a whole number between 1 and MAX_PAGE_SIZE - anything else is a 400,
+    # so no single request can load (and render) the whole table
+    if "limit" not in args:
+        return PAGINATE_BY
+    try:
+        limit = int(args["limit"])
+    except ValueError:
+        abort(400)
+    if not 1 <= limit <= app.config["MAX_PAGE_SIZE"]:
+        abort(400)
+    return limit
+
+def entries_changed():
+    # Called after committing a change to the entries
+    # Read them back from the primary for a while, in case the replicas are behind
+    mark_write()
+    # And drop cached pages which may show the old version
+    invalidate_pages()
+    full_text.entries_changed()
+
+def last_modified(entry):
+    # Rows from before updated_at existed fall back to their creation time
+    return entry.updated_at or entry.datetime
+
+def entry_version(entry):
+    # Changes whenever anything the page shows about the entry changes
+    author = entry.author.name if entry.author else ""
+    return make_etag(entry.id, last_modified(entry), author)
+
+def render_entries(entries, **context):
+    # The ETag covers who is looking (the navigation differs when logged in), the pagination and
+    # every entry on the page, so an unchanged page is answered with a 304 before rendering anything
+    # There's no Last-Modified - the newest entry on a listing doesn't change when an entry is deleted
+    # or entries move between pages, so If-Modified-Since would get a 304 for a page that has changed
+    etag = make_etag(current_user.get_id(), *([entry_version(entry) for entry in entries] +
+                     ["{}={}".format(name, context[name]) for name in sorted(context)]))
+    return conditional_response(etag, None,
+                                lambda: render_template("entries.html", entries=entries, **context))
+
+def newest_entries():
+    # The newest-first listing used by the front page and the feeds
+    # Load each entry's author in the same query, rather than one SELECT per entry when the macro prints the name
+    entries = session.query(Entry).options(joinedload(Entry.author))
+    # id breaks ties between entries created at the same moment, so pages never overlap
+    return entries.order_by(Entry.datetime.desc(), Entry.id.desc())
+
+class StreamedEntries(object):
+    # The entries of a streamed page - rows come from the database in batches while the template is
+    # being sent, and the first and last are remembered for the pager at the bottom of the page
+    def __init__(self, query, limit):
+        # One extra row tells us whether there's an older page
+        self.query = query.limit(limit + 1).yield_per(100)
+        self.limit = limit
+        self.first = None
+        self.last = None
+        self.has_more = False
+        self._has_newer = None
+    
+    def __iter__(self):
+        for count, entry in enumerate(self.query):
+            if count == self.limit:
+                self.has_more = True
+                break
+            if self.first is None:
+                self.first = entry
+            self.last = entry
+            yield entry
+    
+    def has_newer(self):
+        # Asked twice by the pager (has_prev and after), so only checked once
+        if self._has_newer is None:
+            self._has_newer = self.first is not None and newer_exists(self.first)
+        return self._has_newer
+
+class StreamedCursor(object):
+    # Stands in for a pager cursor until the streamed entries have been rendered - the pager comes
+    # after the loop in entries.html, so by the time it's tested and printed the entries are known
+    def __init__(self, entries, which, condition):
+        self.entries = entries
+        self.which = which
+        self.condition = condition
+    
+    def entry(self):
+        return getattr(self.entries, self.which)
+    
+    def __bool__(self):
+        return self.entry() is not None and self.condition()
+    
+    def __str__(self):
+        return format_cursor(self.entry())
+
+def stream_entries(entries, **context):
+    # Render entries.html a piece at a time, so the first entries reach the client straight away
+    # and only a batch of rows is ever held in memory
+    context["entries"] = entries
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template("entries.html").stream(context)
+    stream.enable_buffering(20)
+    return app.response_class(stream_with_context(stream), mimetype="text/html")
+
+def newer_exists(entry):
+    # Whether any entry comes before this one in the newest-first order, i.e. there's a "Newer" page
+    key = tuple_(Entry.datetime, Entry.id)
+    return session.query(session.query(Entry).filter(key > (entry.datetime, entry.id)).exists()).scalar()
+
+def seek_entries(limit, before=None, after=None):
+    # Keyset (seek) pagination: instead of OFFSET, filter on the (datetime, id) index
+    # relative to a cursor, so every page costs the same no matter how deep it is
+    key = tuple_(Entry.datetime, Entry.id)
+    query = session.query(Entry).options(joinedload(Entry.author))
+    others = session.query(Entry)
+    if after is not None:
+        # Walk forwards (towards newer entries) and flip the rows back into newest-first order
+        rows = query.filter(key > after).order_by(Entry.datetime.asc(), Entry.id.asc())
+        rows = rows.limit(limit + 1).all()
+        has_prev = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        has_next = bool(rows) and session.query(
+            others.filter(key < (rows[-1].datetime, rows[-1].id)).exists()).scalar()
+    else:
+        rows = query.filter(key < before).order_by(Entry.datetime.desc(), Entry.id.desc())
+        rows = rows.limit(limit + 1).all()
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = bool(rows) and newer_exists(rows[0])
+    return rows, has_next, has_prev
+
 @app.route("/")
 @app.route("/page/<int:page>") # Designed to take you to a specific page of content
+@cached_page(vary_on=("limit", "before", "after"))
+@read_only
 def entries(page=1):
+    if page < 1:
+        abort(404)
     # Zero-indexed page
     page_index = page - 1
     
     args = request.args
-    if "limit" in args:
-        limit = int(args["limit"])
-    else:
-        limit = PAGINATE_BY
+    limit = parse_limit(args)
+    
+    # Big pages are streamed, rather than rendered into one string before anything is sent
+    stream = limit > app.config["STREAM_THRESHOLD"]
     
-    # Use count method of a query object to find out how many entries there are in total
-    count = session.query(Entry).count()
+    # A big page of older entries (walking forwards with ?after has to reverse the rows, so isn't streamed)
+    if stream and "before" in args and "after" not in args:
+        before = parse_cursor(args["before"])
+        entries = StreamedEntries(newest_entries().filter(tuple_(Entry.datetime, Entry.id) < before), limit)
+        return stream_entries(entries,
+                              has_next=StreamedCursor(entries, "last", lambda: entries.has_more),
+                              has_prev=StreamedCursor(entries, "first", entries.has_newer),
+                              page=page,
+                              total_pages=None,
+                              limit=limit,
+                              before=StreamedCursor(entries, "last", lambda: entries.has_more),
+                              after=StreamedCursor(entries, "first", entries.has_newer)
+                              )
+    
+    # Cursor mode - ?before=<datetime,id> or ?after=<datetime,id> seeks instead of counting and offsetting
+    if "before" in args or "after" in args:
+        before = parse_cursor(args["before"]) if "before" in args else None
+        after = parse_cursor(args["after"]) if "after" in args else None
+        entries, has_next, has_prev = seek_entries(limit, before=before, after=after)
+        return render_entries(entries,
+                              has_next=has_next,
+                              has_prev=has_prev,
+                              page=page,
+                              total_pages=None,
+                              limit=limit,
+                              before=format_cursor(entries[-1]) if has_next else None,
+                              after=format_cursor(entries[0]) if has_prev else None
+                              )
+    
+    # Read the maintained entry counter instead of running a COUNT(*) over the whole table
+    count = entry_count()
     
     # Index of the first entry you should see
     start = page_index * limit
@@ -39,18 +227,55 @@ def entries(page=1):
     # IF there is a page before the current one
     has_prev = page_index > 0
     
-    entries = session.query(Entry)
-    entries = entries.order_by(Entry.datetime.desc())
-    entries = entries[start:end]
+    if stream:
+        entries = StreamedEntries(newest_entries().offset(start), limit)
+        return stream_entries(entries,
+                              has_next=has_next,
+                              has_prev=has_prev,
+                              page=page,
+                              total_pages=total_pages,
+                              limit=limit,
+                              before=StreamedCursor(entries, "last", lambda: has_next),
+                              after=None
+                              )
+    
+    entries = newest_entries()[start:end]
     # Render a template called entries.html, passing in the list of entries
-    return render_template("entries.html", 
-                            entries=entries,
-                            has_next=has_next,
-                            has_prev=has_prev,
-                            page=page,
-                            total_pages=total_pages,
-                            limit=limit # parameter for the html
-                            )
+    # The "Older" link hands out a cursor, so crawlers following it never reach a deep OFFSET
+    return render_entries(entries,
+                          has_next=has_next,
+                          has_prev=has_prev,
+                          page=page,
+                          total_pages=total_pages,
+                          limit=limit, # parameter for the html
+                          before=format_cursor(entries[-1]) if has_next and entries else None,
+                          after=None
+                          )
+
+def render_feed(template, content_type):
+    # Feeds use the pre-rendered entry HTML, and are the same for everyone, so the serialized feed is
+    # cached (see cached_page) until the next write, and carries an ETag for conditional GET
+    # Like the listings, no Last-Modified - deleting an entry changes the feed without making it any newer
+    entries = newest_entries().limit(app.config["FEED_SIZE"]).all()
+    etag = make_etag(template, *[entry_version(entry) for entry in entries])
+    updated = max(last_modified(entry) for entry in entries) if entries else None
+    
+    def render():
+        return app.response_class(render_template(template, entries=entries, updated=updated),
+                                  content_type=content_type)
+    return conditional_response(etag, None, render)
+
+@app.route("/feed.atom")
+@cached_page(shared=True)
+@read_only
+def atom_feed():
+    return render_feed("atom.xml", "application/atom+xml")
+
+@app.route("/feed.rss")
+@cached_page(shared=True)
+@read_only
+def rss_feed():
+    return render_feed("rss.xml", "application/rss+xml")
 
 # The methods=["GET"] parameter specifies that the route will only be used for GET requests to the page
 @app.route("/entry/add", methods=["GET"])
@@ -68,15 +293,85 @@ def add_entry_post():
         content=request.form["content"],
         author=current_user
         )
+    # Render the Markdown once here, instead of on every page view
+    entry.content_html = render_markdown(entry.content)
     session.add(entry)
+    # Flush first, so the entry has its datetime for the archive summary
+    session.flush()
+    adjust_entry_count(1)
+    adjust_month_count(entry.datetime, 1)
     session.commit()
+    entries_changed()
     # The redirect function sends the user back to the front page once their entry has been created
     return redirect(url_for("entries"))
 
 @app.route("/entry/<int:eid>")
+@read_only
 def view_entry(eid):
-    entry = session.query(Entry).filter_by(id=eid).first()
-    return render_template("entry.html", entries=entry)
+    entry = session.query(Entry).options(joinedload(Entry.author)).filter_by(id=eid).first()
+    if not entry:
+        abort(404)
+    etag = make_etag(current_user.get_id(), entry_version(entry))
+    return conditional_response(etag, last_modified(entry),
+                                lambda: render_template("entry.html", entries=entry))
+    
+def entry_titles():
+    # A lightweight projection for pages which only list titles - rows are plain tuples of
+    # (id, title, datetime, updated_at, author), so the content columns never leave the database
+    query = session.query(Entry.id, Entry.title, Entry.datetime, Entry.updated_at, User.name.label("author"))
+    query = query.outerjoin(User, Entry.author_id == User.id)
+    return query.order_by(Entry.datetime.desc(), Entry.id.desc())
+
+@app.route("/author/<int:uid>")
+@read_only
+def author_entries(uid):
+    author = session.query(User).get(uid)
+    if not author:
+        abort(404)
+    entries = entry_titles().filter(Entry.author_id == uid).all()
+    return render_template("author_entries.html", author=author, entries=entries)
+
+@app.route("/sitemap.xml")
+@read_only
+def sitemap():
+    entries = session.query(Entry.id, Entry.updated_at).order_by(Entry.datetime.desc(), Entry.id.desc())
+    xml = render_template("sitemap.xml", entries=entries.all())
+    return app.response_class(xml, content_type="application/xml")
+    
+@app.route("/archive")
+@read_only
+def archive():
+    # Post counts per month come straight from the summary table - no GROUP BY over the entries
+    months = session.query(EntryMonth).filter(EntryMonth.entry_count > 0)
+    months = months.order_by(EntryMonth.year.desc(), EntryMonth.month.desc()).all()
+    return render_template("archive.html", months=months)
+
+@app.route("/archive/<int:year>/<int:month>")
+@read_only
+def archive_month(year, month):
+    # The month must exist, and so must the one after it (the end of the range)
+    if not 1 <= month <= 12 or not datetime.MINYEAR <= year < datetime.MAXYEAR:
+        abort(404)
+    # A range on the datetime index, listing titles only
+    start, end = month_range(year, month)
+    entries = entry_titles().filter(Entry.datetime >= start, Entry.datetime < end).all()
+    return render_template("archive_month.html", start=start, entries=entries)
+    
+@app.route("/search")
+@read_only
+def search():
+    query = request.args.get("q", "").strip()
+    before = None
+    if "before" in request.args:
+        try:
+            before = full_text.parse_cursor(request.args["before"])
+        except ValueError:
+            abort(400)
+    
+    results, has_next = full_text.search_entries(query, PAGINATE_BY, before) if query else ([], False)
+    # Like the entries index, further results are reached with a keyset cursor, here on (rank, id)
+    next_cursor = full_text.format_cursor(results[-1].rank, results[-1].id) if has_next else None
+    return render_template("search.html", query=query, results=results, before=next_cursor)
     
 @app.route("/entry/<int:eid>/edit", methods=["GET"])
 def edit_entry_get(eid):
@@ -99,19 +394,27 @@ def edit_entry_post(eid):
     if not all([entry.author, current_user]) or entry.author.id != current_user.id:
         raise Forbidden("Only Author can edit this post")
     
-    entry.title=request.form["title"],
-    entry.content=request.form["content"]
+    entry.title = request.form["title"]
+    entry.content = request.form["content"]
+    entry.content_html = render_markdown(entry.content)
     session.commit()
+    entries_changed()
     return redirect(url_for("entries"))
     
 @app.route("/entry/<int:eid>/delete", methods=["GET"])
 def delete_entry(eid):
-    entry = session.query(Entry).filter_by(id=eid).delete()
+    entry = session.query(Entry).filter_by(id=eid).first()
+    if not entry:
+        abort(404)
     
     if not all([entry.author, current_user]) or entry.author.id != current_user.id:
         raise Forbidden("Only Author can delete this post")
     
+    session.delete(entry)
+    adjust_entry_count(-1)
+    adjust_month_count(entry.datetime, -1)
     session.commit()
+    entries_changed()
     return redirect(url_for("entries"))
 
 @app.route("/login", methods=["GET"])
@@ -122,14 +425,33 @@ def login_get():
 def login_post():
     email = request.form["email"]
     password = request.form["password"]
+    # Refuse straight away after too many failed attempts from this address or for this account
+    # (behind a proxy, remote_addr needs werkzeug's ProxyFix to be the client's address)
+    if not passwords.login_allowed(request.remote_addr, email):
+        flash("Too many failed logins, please try again in a few minutes", "danger")
+        return redirect(url_for("login_get"))
+    
     user = session.query(User).filter_by(email=email).first()
-    # Check if that user exists and use Werkzeug's check_password_hash function to compare
-    # the password the user entered with the hash stored in the database
-    if not user or not check_password_hash(user.password, password):
+    # Check if that user exists and compare the password the user entered with the hash stored in the database
+    try:
+        valid = user is not None and passwords.check_password(user.password, password)
+    except passwords.HashingBusy:
+        abort(503)
+    if not valid:
+        passwords.login_failed(request.remote_addr, email)
         # flash function stores a message which you can use when you render the next page
         flash("Incorrect username or password", "danger")
         return redirect(url_for("login_get"))
     
+    # The hash method has changed since the password was set - store a new hash while we have the password
+    if passwords.needs_rehash(user.password):
+        try:
+            user.password = passwords.hash_password(password)
+            session.commit()
+        except passwords.HashingBusy:
+            # Try again next time
+            pass
+    
     # login_user function allows cookies (a small chunk of data) to the user's browser which is used to identify the user
     # when the user tries to access a protected resource, Flask-Login will make sure that they have the cookie set and allowed to access
     login_user(user)
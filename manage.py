@@ -1,9 +1,13 @@
 import os
 from getpass import getpass
-from werkzeug.security import generate_password_hash
 from flask.ext.script import Manager
-from blog.database import session, Entry, User, Base
-from flask.ext.migrate import Migrate, MigrateCommand
+from blog.filters import render_markdown
+from blog.search import reindex_entries
+from blog.profiler import make_profile_token
+from blog.login import invalidate_user
+from blog.passwords import hash_password
+from blog.database import session, engine, Entry, User, Base, adjust_entry_count, reconcile_entry_count, rebuild_month_counts
+from flask.ext.migrate import Migrate, MigrateCommand, stamp
 
 from blog import app
 
@@ -15,7 +19,46 @@ manager = Manager(app)
 @manager.command
 def run():
     port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
+    # Each request has its own database session, so requests can be served on separate threads
+    app.run(host='0.0.0.0', port=port, threaded=True)
+
+# Recompute the archive's per-month summary from the entries table
+# Exec - python manage.py rebuild_archive
+@manager.command
+def rebuild_archive():
+    months = rebuild_month_counts()
+    session.commit()
+    print("Rebuilt {} months".format(months))
+
+# Rebuild every entry's full-text search vector - run it after changing SEARCH_LANGUAGE
+# Exec - python manage.py reindex_search
+@manager.command
+def reindex_search():
+    count = reindex_entries()
+    session.commit()
+    print("Reindexed {} entries".format(count))
+
+# Compile every template into the Jinja bytecode cache, so workers don't compile them on their first requests
+# Exec - python manage.py compile_templates (as part of the build/deploy, with the same config as the workers)
+@manager.command
+def compile_templates():
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    print("Compiled {} templates".format(len(names)))
+
+# Print a token which profiles a single request when added to its URL as ?profile=<token>
+# Exec - python manage.py profile_token (with the same SECRET_KEY as the server; tokens expire after PROFILE_TOKEN_MAX_AGE seconds)
+@manager.command
+def profile_token():
+    print(make_profile_token())
+
+# Construct the tables in a new, empty database, and mark it as up to date with the migrations
+# Exec - python manage.py create_db (existing databases use python manage.py db upgrade instead)
+@manager.command
+def create_db():
+    Base.metadata.create_all(engine)
+    stamp()
 
 # Create example entries to database for early testing
 # Exec - python manage.py seed
@@ -33,7 +76,35 @@ def seed():
             content=content
             )
         session.add(entry)
+    adjust_entry_count(25)
+    session.commit()
+    rebuild_month_counts()
+    session.commit()
+
+# Fill in content_html for entries whose pre-rendered HTML is missing or stale
+# Exec - python manage.py render_content (add --rerender to render every entry again)
+@manager.command
+def render_content(rerender=False):
+    ids = session.query(Entry.id)
+    if not rerender:
+        ids = ids.filter(Entry.content_html == None)
+    ids = [eid for eid, in ids]
+    
+    # Work in batches so a large table never sits in one transaction or in memory all at once
+    for start in range(0, len(ids), 100):
+        batch = session.query(Entry).filter(Entry.id.in_(ids[start:start + 100]))
+        for entry in batch:
+            entry.content_html = render_markdown(entry.content)
+        session.commit()
+    print("Rendered {} entries".format(len(ids)))
+
+# Recompute the maintained counters from the tables, in case they have drifted
+# Exec - python manage.py reconcile_counts (e.g. from a nightly cron job)
+@manager.command
+def reconcile_counts():
+    count = reconcile_entry_count()
     session.commit()
+    print("entries: {}".format(count))
 
 @manager.command
 def adduser():
@@ -49,10 +120,12 @@ def adduser():
         password = getpass("Password: ")
         password_2 = getpass("Re-enter password: ")
     # Hashing is the process which converts the plain text password to a string of characters
+    # (using PASSWORD_HASH_METHOD from the config)
     user = User(name=name, email=email,
-                password=generate_password_hash(password))
+                password=hash_password(password))
     session.add(user)
     session.commit()
+    invalidate_user(user.id)
 
 # Class DB is designed to hold your metadata object
 # Alembic uses the metadata to work out what the changes to the database schema should be
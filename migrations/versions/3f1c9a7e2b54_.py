@@ -0,0 +1,22 @@
+"""add (datetime, id) index on entries for keyset pagination
+
+Revision ID: 3f1c9a7e2b54
+Revises: 9cd8d7d8498e
+Create Date: 2016-06-02 10:14:08.512337
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7e2b54'
+down_revision = '9cd8d7d8498e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_entries_datetime_id', 'entries', ['datetime', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_entries_datetime_id', table_name='entries')
@@ -0,0 +1,23 @@
+"""add pre-rendered content_html column to entries
+
+Revision ID: 5b27e0d9f6a1
+Revises: a84e3d61c0f7
+Create Date: 2016-06-06 14:22:37.904518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b27e0d9f6a1'
+down_revision = 'a84e3d61c0f7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Existing rows start out NULL (stale) - run "python manage.py render_content" to backfill them
+    op.add_column('entries', sa.Column('content_html', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('entries', 'content_html')
@@ -0,0 +1,28 @@
+"""add counters table with a maintained entry count
+
+Revision ID: a84e3d61c0f7
+Revises: 3f1c9a7e2b54
+Create Date: 2016-06-03 09:41:52.170214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a84e3d61c0f7'
+down_revision = '3f1c9a7e2b54'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('counters',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # Seed the counter from the existing rows
+    op.execute("INSERT INTO counters (name, value) SELECT 'entries', COUNT(*) FROM entries")
+
+
+def downgrade():
+    op.drop_table('counters')
@@ -0,0 +1,31 @@
+"""add entries.updated_at and indexes for listing
+
+Revision ID: c3d8f2a4e915
+Revises: 5b27e0d9f6a1
+Create Date: 2016-06-10 16:05:44.318926
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c3d8f2a4e915'
+down_revision = '5b27e0d9f6a1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('entries', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # Existing entries were last changed, as far as we know, when they were created
+    op.execute("UPDATE entries SET updated_at = datetime")
+    op.create_index('ix_entries_author_id', 'entries', ['author_id'], unique=False)
+    # Replace the ascending (datetime, id) index with one in the newest-first listing order
+    op.drop_index('ix_entries_datetime_id', table_name='entries')
+    op.execute("CREATE INDEX ix_entries_datetime_desc_id_desc ON entries (datetime DESC, id DESC)")
+
+
+def downgrade():
+    op.drop_index('ix_entries_datetime_desc_id_desc', table_name='entries')
+    op.create_index('ix_entries_datetime_id', 'entries', ['datetime', 'id'], unique=False)
+    op.drop_index('ix_entries_author_id', table_name='entries')
+    op.drop_column('entries', 'updated_at')
@@ -0,0 +1,31 @@
+"""add entry_months summary table for the archive
+
+Revision ID: d71a05b6c2e8
+Revises: c3d8f2a4e915
+Create Date: 2016-06-14 11:27:03.645190
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd71a05b6c2e8'
+down_revision = 'c3d8f2a4e915'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('entry_months',
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('entry_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('year', 'month')
+    )
+    # Fill the summary from the existing entries
+    op.execute("INSERT INTO entry_months (year, month, entry_count) "
+               "SELECT CAST(EXTRACT(YEAR FROM datetime) AS INTEGER), CAST(EXTRACT(MONTH FROM datetime) AS INTEGER), COUNT(*) "
+               "FROM entries GROUP BY 1, 2")
+
+
+def downgrade():
+    op.drop_table('entry_months')
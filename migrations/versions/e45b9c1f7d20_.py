@@ -0,0 +1,31 @@
+"""add full-text search_vector to entries with a GIN index
+
+Revision ID: e45b9c1f7d20
+Revises: d71a05b6c2e8
+Create Date: 2016-06-17 15:48:26.071553
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e45b9c1f7d20'
+down_revision = 'd71a05b6c2e8'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from flask import current_app
+
+
+def upgrade():
+    op.add_column('entries', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    # Index the existing entries the same way search.index_entry does for new ones, in the configured language
+    entries = sa.table('entries', sa.column('title'), sa.column('content'), sa.column('search_vector'))
+    document = sa.func.coalesce(entries.c.title, '') + ' ' + sa.func.coalesce(entries.c.content, '')
+    op.execute(entries.update().values(
+        search_vector=sa.func.to_tsvector(current_app.config['SEARCH_LANGUAGE'], document)))
+    op.create_index('ix_entries_search_vector', 'entries', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_entries_search_vector', table_name='entries')
+    op.drop_column('entries', 'search_vector')
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Configure your app to use the testing configuration
+if not "CONFIG_PATH" in os.environ:
+    os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog.cache import LRUCache
+from blog.page_cache import MemoryPageCache, FileSystemPageCache
+
+class LRUCacheTests(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", "1")
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.get("b"), None)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+    
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        # Touch "a" so "b" becomes the least recently used
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.get("c"), "3")
+    
+    def test_max_bytes(self):
+        cache = LRUCache(max_entries=10, max_bytes=10)
+        cache.set("a", "x" * 6)
+        cache.set("b", "x" * 6)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.stats()["bytes"], 6)
+        # Values bigger than the whole cache are never stored
+        cache.set("c", "x" * 11)
+        self.assertEqual(cache.get("c"), None)
+    
+    def test_ttl(self):
+        cache = LRUCache(ttl=0)
+        cache.set("a", "1")
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.stats()["entries"], 0)
+        cache = LRUCache(ttl=60)
+        cache.set("a", "1")
+        self.assertEqual(cache.get("a"), "1")
+
+class PageCacheTests(unittest.TestCase):
+    page = {"status": 200, "content_type": "text/html; charset=utf-8", "body": b"<html></html>"}
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def check_backend(self, cache):
+        self.assertEqual(cache.get("/"), None)
+        cache.set("/", self.page)
+        self.assertEqual(cache.get("/"), self.page)
+        cache.clear()
+        self.assertEqual(cache.get("/"), None)
+    
+    def test_memory(self):
+        self.check_backend(MemoryPageCache(ttl=60))
+    
+    def test_filesystem(self):
+        self.check_backend(FileSystemPageCache(self.directory, ttl=60))
+    
+    def test_filesystem_shared(self):
+        # Two processes pointing at the same directory see each other's pages
+        FileSystemPageCache(self.directory, ttl=60).set("/", self.page)
+        self.assertEqual(FileSystemPageCache(self.directory, ttl=60).get("/"), self.page)
+    
+    def test_filesystem_format(self):
+        cache = FileSystemPageCache(self.directory, ttl=60)
+        page = dict(self.page, headers=[("ETag", '"abc"')])
+        cache.set("/", page)
+        self.assertEqual(cache.get("/"), page)
+        # Stored as JSON and the raw body, not as anything that gets executed when it's loaded
+        with open(cache.path("/"), "rb") as f:
+            self.assertTrue(f.read().startswith(b"{"))
+    
+    def test_filesystem_must_be_private(self):
+        os.chmod(self.directory, 0o777)
+        self.assertRaises(ValueError, FileSystemPageCache, self.directory, 60)
+    
+    def test_expiry(self):
+        cache = MemoryPageCache(ttl=60)
+        cache.set("/", self.page)
+        expires, page = cache.pages.get("/")
+        cache.pages.set("/", (time.time() - 1, page))
+        self.assertEqual(cache.get("/"), None)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,7 @@ if not "CONFIG_PATH" in os.environ:
 
 import blog
 from blog.filters import *
+from blog.database import Entry
 
 class FilterTests(unittest.TestCase):
     def test_date_format(self):
@@ -19,6 +20,29 @@ class FilterTests(unittest.TestCase):
     def test_date_format_none(self):
         formatted = dateformat(None, "%y/%m/%d")
         self.assertEqual(formatted, None)
+    
+    def test_markdown_cached(self):
+        markdown_cache.clear()
+        before = markdown_cache.stats()
+        first = markdown("Some *cached* text")
+        second = markdown("Some *cached* text")
+        self.assertEqual(first, second)
+        stats = markdown_cache.stats()
+        self.assertEqual(stats["misses"] - before["misses"], 1)
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+    
+    def test_entry_content_prerendered(self):
+        entry = Entry(content="*Test*")
+        entry.content_html = "<p>Cached</p>"
+        self.assertEqual(entry_content(entry), "<p>Cached</p>")
+    
+    def test_entry_content_stale(self):
+        # Changing content marks the pre-rendered HTML as stale, so it's rendered live
+        entry = Entry(content="*Test*")
+        entry.content_html = "<p>Cached</p>"
+        entry.content = "*New*"
+        self.assertEqual(entry.content_html, None)
+        self.assertIn("<em>New</em>", entry_content(entry))
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,61 @@
+import os
+import time
+import tracemalloc
+import unittest
+
+from werkzeug.security import generate_password_hash
+
+# Configure your app to use the testing database
+if not "CONFIG_PATH" in os.environ:
+    os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import app
+from blog.database import Base, engine, session, User, Entry
+
+# A single request must stay within these, however big a page it asks for
+MEMORY_BUDGET = 32 * 1024 * 1024
+TIME_BUDGET = 10
+
+class TestPageSizeLimit(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        # More entries than the biggest page allowed, each with a few KB of Markdown
+        content = "Lorem *ipsum* dolor sit amet, consectetur adipisicing elit.\n\n" * 50
+        alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(alice)
+        for i in range(app.config["MAX_PAGE_SIZE"] + 50):
+            session.add(Entry(title="Entry #{}".format(i), content=content, author=alice))
+        session.commit()
+    
+    def test_bad_limits(self):
+        for limit in ["0", "-5", "ten", "", str(app.config["MAX_PAGE_SIZE"] + 1), "1000000"]:
+            response = self.client.get("/?limit=" + limit)
+            self.assertEqual(response.status_code, 400, limit)
+    
+    def test_biggest_page_within_budget(self):
+        tracemalloc.start()
+        start = time.time()
+        try:
+            response = self.client.get("/?limit={}".format(app.config["MAX_PAGE_SIZE"]))
+            # Read the whole (possibly streamed) body, so all of the rendering is measured
+            size = len(response.get_data())
+            elapsed = time.time() - start
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(size > 0)
+        self.assertLess(elapsed, TIME_BUDGET)
+        self.assertLess(peak, MEMORY_BUDGET)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+if __name__ == "__main__":
+    unittest.main()
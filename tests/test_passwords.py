@@ -0,0 +1,59 @@
+import os
+import time
+import unittest
+
+# Configure your app to use the testing configuration
+if not "CONFIG_PATH" in os.environ:
+    os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from werkzeug.security import generate_password_hash
+
+from blog import app
+from blog import passwords
+
+class PasswordHashTests(unittest.TestCase):
+    def test_hash_in_worker_process(self):
+        pwhash = passwords.hash_password("secret")
+        self.assertTrue(pwhash.startswith(app.config["PASSWORD_HASH_METHOD"] + "$"))
+        self.assertTrue(passwords.check_password(pwhash, "secret"))
+        self.assertFalse(passwords.check_password(pwhash, "wrong"))
+    
+    def test_needs_rehash(self):
+        self.assertFalse(passwords.needs_rehash(generate_password_hash("secret", method=app.config["PASSWORD_HASH_METHOD"])))
+        self.assertTrue(passwords.needs_rehash(generate_password_hash("secret", method="pbkdf2:sha256:1000")))
+
+class PasswordPoolTests(unittest.TestCase):
+    def test_broken_pool_replaced(self):
+        # A hashing process dying breaks its pool - that hash is refused, and the next gets a new pool
+        self.assertRaises(passwords.HashingBusy, passwords.run, os._exit, 1)
+        self.assertTrue(passwords.check_password(passwords.hash_password("secret"), "secret"))
+    
+    def test_stuck_hash_times_out(self):
+        timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        app.config["PASSWORD_HASH_TIMEOUT"] = 0.1
+        try:
+            self.assertRaises(passwords.HashingBusy, passwords.run, time.sleep, 1)
+        finally:
+            app.config["PASSWORD_HASH_TIMEOUT"] = timeout
+
+class LoginRateLimitTests(unittest.TestCase):
+    def setUp(self):
+        passwords.failed_logins.clear()
+    
+    def test_limit_per_email(self):
+        for i in range(app.config["LOGIN_RATE_LIMIT"]):
+            self.assertTrue(passwords.login_allowed("10.0.0.{}".format(i), "alice@example.com"))
+            passwords.login_failed("10.0.0.{}".format(i), "Alice@example.com")
+        self.assertFalse(passwords.login_allowed("10.0.0.100", "alice@example.com"))
+        self.assertTrue(passwords.login_allowed("10.0.0.100", "bob@example.com"))
+    
+    def test_limit_per_address(self):
+        for i in range(app.config["LOGIN_RATE_LIMIT"]):
+            passwords.login_failed("10.0.0.1", "user{}@example.com".format(i))
+        self.assertFalse(passwords.login_allowed("10.0.0.1", "new@example.com"))
+    
+    def tearDown(self):
+        passwords.failed_logins.clear()
+
+if __name__ == "__main__":
+    unittest.main()
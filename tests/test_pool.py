@@ -0,0 +1,26 @@
+import sqlite3
+import unittest
+
+from blog.pool import TimedQueuePool
+
+class TimedQueuePoolTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = TimedQueuePool(lambda: sqlite3.connect(":memory:"),
+                                   pool_size=2, max_overflow=2)
+    
+    def test_checkout_stats(self):
+        connection = self.pool.connect()
+        stats = self.pool.stats()
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertEqual(stats["checked_out"], 1)
+        self.assertEqual(stats["saturation"], 0.25)
+        self.assertTrue(stats["checkout_wait_max"] >= 0)
+        
+        connection.close()
+        self.assertEqual(self.pool.stats()["checked_out"], 0)
+    
+    def tearDown(self):
+        self.pool.dispose()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import re
+import unittest
+
+from werkzeug.security import generate_password_hash
+
+# Search is testable without Postgres - SQLite uses the pure-Python fallback index
+if not "CONFIG_PATH" in os.environ:
+    os.environ["CONFIG_PATH"] = "blog.config.SQLiteTestingConfig"
+
+from blog import app
+from blog.database import Base, engine, session, User
+from blog.search import InvertedIndex
+
+class InvertedIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, "Flask and SQLAlchemy")
+        self.index.add(2, "Postgres, Postgres and more Postgres")
+        self.index.add(3, "Flask with postgres")
+    
+    def test_all_words_must_match(self):
+        self.assertEqual([eid for score, eid in self.index.search("flask postgres")], [3])
+    
+    def test_ranked_by_frequency(self):
+        self.assertEqual([eid for score, eid in self.index.search("POSTGRES")], [2, 3])
+    
+    def test_no_words(self):
+        self.assertEqual(self.index.search("  !? "), [])
+
+class SearchViewTests(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        session.commit()
+        
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.alice.id)
+            http_session["_fresh"] = True
+        
+        # Add the entries through the view, so they're indexed the way real ones are
+        for i in range(15):
+            self.client.post("/entry/add", data={
+                "title": "Kitten #{}".format(i),
+                "content": "Kittens are fluffy" if i % 2 else "Puppies are loud"
+            })
+    
+    def titles(self, response):
+        return re.findall(r"Kitten #\d+", response.data.decode("utf-8"))
+    
+    def test_search(self):
+        response = self.client.get("/search?q=fluffy")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.titles(response)), 7)
+        
+        response = self.client.get("/search?q=giraffe")
+        self.assertEqual(self.titles(response), [])
+    
+    def test_pagination(self):
+        # 15 matches, 10 per page, and the second page picks up exactly where the first ended
+        response = self.client.get("/search?q=kitten")
+        first = self.titles(response)
+        self.assertEqual(len(first), 10)
+        
+        cursor = re.search(r"before=([^&\"]+)", response.data.decode("utf-8")).group(1)
+        second = self.titles(self.client.get("/search?q=kitten&before=" + cursor))
+        self.assertEqual(len(second), 5)
+        self.assertEqual(len(set(first + second)), 15)
+    
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get("/search?q=kitten&before=nope").status_code, 400)
+        for rank in ("NaN", "sNaN", "Infinity", "-Infinity"):
+            self.assertEqual(self.client.get("/search?q=kitten&before={},1".format(rank)).status_code, 400)
+        self.assertEqual(self.client.get("/search?q=kitten&before=1.0,99999999999999999999").status_code, 400)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+if __name__ == "__main__":
+    unittest.main()
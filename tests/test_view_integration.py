@@ -1,14 +1,23 @@
 import os
+import shutil
+import tempfile
 import unittest
+import datetime
 from urllib.parse import urlparse
 
 from werkzeug.security import generate_password_hash
+from sqlalchemy import event, create_engine
 
 # Configure your app to use the testing database
 os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
 
-from blog import app
-from blog.database import Base, engine, session, User, Entry
+from blog import app, page_cache
+from blog.filters import fragment_cache
+from blog.profiler import make_profile_token
+from blog.login import user_cache, invalidate_user
+from blog import passwords
+from manage import render_content
+from blog.database import Base, engine, session, User, Entry, EntryMonth, entry_count, replica_engines
 
 class TestAddEntry(unittest.TestCase):
     def setUp(self):
@@ -51,7 +60,10 @@ class TestAddEntry(unittest.TestCase):
         entry = entries[0]
         self.assertEqual(entry.title, "Test Entry")
         self.assertEqual(entry.content, "Test Content")
+        self.assertEqual(entry.content_html, "<p>Test Content</p>\n")
         self.assertEqual(entry.author, self.user)
+        # The maintained counter moves with the new entry
+        self.assertEqual(entry_count(), 1)
     
     def tearDown(self):
         """ Test teardown """
@@ -170,10 +182,800 @@ class TestDeleteEntry(unittest.TestCase):
         entry = entries[0]
         self.assertEqual(entry.author, self.alice)
     
+    def test_delete_updates_count(self):
+        self.simulate_login()
+        entry = session.query(Entry).first()
+        
+        response = self.client.get("/entry/{}/delete".format(entry.id))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(session.query(Entry).count(), 0)
+        self.assertEqual(entry_count(), 0)
+    
     def tearDown(self):
         session.close()
         # Remove the tables and their data from the database
         Base.metadata.drop_all(engine)
 
+class TestEntriesPagination(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        # Entry #0 is the oldest, Entry #4 the newest
+        start = datetime.datetime(2016, 1, 1)
+        for i in range(5):
+            session.add(Entry(title="Entry #{}".format(i), content="Content",
+                              author=self.alice, datetime=start + datetime.timedelta(days=i)))
+        session.commit()
+    
+    def titles(self, response):
+        data = response.data.decode("utf-8")
+        return [i for i in range(5) if "Entry #{}".format(i) in data]
+    
+    def test_cursor_matches_offset_pages(self):
+        first = session.query(Entry).filter_by(title="Entry #3").one()
+        cursor = "{:%Y-%m-%dT%H:%M:%S.%f},{}".format(first.datetime, first.id)
+        
+        by_cursor = self.client.get("/?limit=2&before=" + cursor)
+        by_page = self.client.get("/page/2?limit=2")
+        self.assertEqual(by_cursor.status_code, 200)
+        self.assertEqual(self.titles(by_cursor), [1, 2])
+        self.assertEqual(self.titles(by_page), [1, 2])
+    
+    def test_cursor_after(self):
+        oldest = session.query(Entry).filter_by(title="Entry #0").one()
+        cursor = "{:%Y-%m-%dT%H:%M:%S.%f},{}".format(oldest.datetime, oldest.id)
+        
+        response = self.client.get("/?limit=2&after=" + cursor)
+        self.assertEqual(self.titles(response), [1, 2])
+    
+    def test_bad_cursor(self):
+        response = self.client.get("/?before=yesterday")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/?before=2016-01-01T00:00:00.000000,99999999999999999999")
+        self.assertEqual(response.status_code, 400)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestEntriesQueryCount(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        # Give every entry its own author, so lazy loading would need one SELECT per entry
+        for i in range(20):
+            author = User(name="Author {}".format(i), email="author{}@example.com".format(i),
+                          password=generate_password_hash("test"))
+            session.add(Entry(title="Entry #{}".format(i), content="Content", author=author))
+        session.commit()
+        
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self.count_statement)
+    
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    def statements_for(self, url):
+        del self.statements[:]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(self.statements)
+    
+    def test_entries_fixed_statement_count(self):
+        small = self.statements_for("/?limit=2")
+        large = self.statements_for("/?limit=20")
+        self.assertEqual(small, large)
+    
+    def test_search_vector_not_loaded(self):
+        self.statements_for("/")
+        self.assertFalse([statement for statement in self.statements if "search_vector" in statement])
+    
+    def test_view_entry_loads_author(self):
+        entry = session.query(Entry).first()
+        self.assertEqual(self.statements_for("/entry/{}".format(entry.id)), 1)
+    
+    def tearDown(self):
+        event.remove(engine, "before_cursor_execute", self.count_statement)
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestRequestSessions(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        session.add(User(name="Alice", email="alice@example.com",
+                         password=generate_password_hash("test")))
+        session.commit()
+    
+    def test_session_per_app_context(self):
+        outside = session()
+        with app.app_context():
+            inside = session()
+            self.assertIsNot(inside, outside)
+            users = inside.query(User).all()
+            self.assertEqual(len(inside.identity_map), 1)
+        # Tearing down the app context closes its session and frees the identity map
+        self.assertEqual(len(inside.identity_map), 0)
+        self.assertIs(session(), outside)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestReplicaRouting(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        session.add(Entry(title="Test Title", content="Test Content", author=self.alice))
+        session.commit()
+        
+        # The "replica" is just another engine for the test database, so we can see which one gets queried
+        self.replica = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+        self.replica_statements = []
+        event.listen(self.replica, "before_cursor_execute", self.count_statement)
+        replica_engines.append(self.replica)
+    
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.replica_statements.append(statement)
+    
+    def simulate_login(self):
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.alice.id)
+            http_session["_fresh"] = True
+    
+    def test_reads_use_replica(self):
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Test Title", response.data)
+        self.assertTrue(self.replica_statements)
+    
+    def test_read_your_writes(self):
+        self.simulate_login()
+        self.client.post("/entry/add", data={"title": "New Title", "content": "New Content"})
+        
+        response = self.client.get("/")
+        self.assertIn(b"New Title", response.data)
+        self.assertEqual(self.replica_statements, [])
+    
+    def test_cache_fills_use_primary(self):
+        page_cache.feed_cache.clear()
+        response = self.client.get("/feed.atom")
+        self.assertIn(b"Test Title", response.data)
+        self.assertEqual(self.replica_statements, [])
+        page_cache.feed_cache.clear()
+    
+    def test_failed_replica_falls_back(self):
+        def unavailable():
+            raise engine.dialect.dbapi.OperationalError("replica is down")
+        replica_engines[:] = [create_engine(app.config["SQLALCHEMY_DATABASE_URI"], creator=unavailable)]
+        
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Test Title", response.data)
+    
+    def tearDown(self):
+        del replica_engines[:]
+        self.replica.dispose()
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.anonymous = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        session.add(Entry(title="First Title", content="Test Content", author=self.alice))
+        session.commit()
+        
+        page_cache.page_cache = page_cache.MemoryPageCache(ttl=60)
+    
+    def simulate_login(self):
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.alice.id)
+            http_session["_fresh"] = True
+    
+    def test_anonymous_pages_cached(self):
+        self.assertIn(b"First Title", self.anonymous.get("/").data)
+        # Changed behind the app's back, so the cached page is still served
+        session.add(Entry(title="Sneaky Title", content="Test Content", author=self.alice))
+        session.commit()
+        self.assertNotIn(b"Sneaky Title", self.anonymous.get("/").data)
+        # But a different limit is a different page
+        self.assertIn(b"Sneaky Title", self.anonymous.get("/?limit=5").data)
+    
+    def test_pages_setting_cookies_not_cached(self):
+        def set_cookie(response):
+            response.set_cookie("tracking", "1")
+            return response
+        app.after_request_funcs[None].append(set_cookie)
+        try:
+            response = self.anonymous.get("/")
+        finally:
+            app.after_request_funcs[None].remove(set_cookie)
+        self.assertIn("Set-Cookie", response.headers)
+        self.assertEqual(page_cache.page_cache.pages.stats()["entries"], 0)
+    
+    def test_write_invalidates(self):
+        self.assertIn(b"First Title", self.anonymous.get("/").data)
+        
+        self.simulate_login()
+        self.client.post("/entry/add", data={"title": "New Title", "content": "New Content"})
+        self.assertIn(b"New Title", self.anonymous.get("/").data)
+    
+    def tearDown(self):
+        page_cache.page_cache = None
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        self.entry = Entry(title="Test Title", content="Test Content", author=self.alice)
+        session.add(self.alice)
+        session.add(self.entry)
+        session.commit()
+    
+    def check_not_modified(self, url, last_modified=True):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertEqual("Last-Modified" in response.headers, last_modified)
+        
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        return etag
+    
+    def test_view_entry(self):
+        url = "/entry/{}".format(self.entry.id)
+        etag = self.check_not_modified(url)
+        
+        # Editing the entry changes its ETag, so the old copy is no longer current
+        self.entry.content = "Changed Content"
+        session.commit()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Changed Content", response.data)
+    
+    def test_entries(self):
+        etag = self.check_not_modified("/", last_modified=False)
+        
+        session.add(Entry(title="New Title", content="New Content", author=self.alice))
+        session.commit()
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_entries_if_modified_since_after_delete(self):
+        newest = Entry(title="New Title", content="New Content", author=self.alice)
+        session.add(newest)
+        session.commit()
+        self.client.get("/?limit=1")
+        session.delete(newest)
+        session.commit()
+        # The page changed without getting any newer, so a date alone can't be trusted
+        response = self.client.get("/?limit=1", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Test Title", response.data)
+    
+    def test_cached_page_not_modified(self):
+        page_cache.page_cache = page_cache.MemoryPageCache(ttl=60)
+        try:
+            etag = self.check_not_modified("/", last_modified=False)
+            # The second request was answered from the page cache
+            response = self.client.get("/", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+        finally:
+            page_cache.page_cache = None
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestTitleListings(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        self.peter = User(name="Peter", email="peter@example.com",
+                     password=generate_password_hash("test"))
+        session.add(Entry(title="Alice Title", content="Alice Content", author=self.alice))
+        session.add(Entry(title="Peter Title", content="Peter Content", author=self.peter))
+        session.commit()
+        
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self.count_statement)
+    
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    def test_author_entries(self):
+        response = self.client.get("/author/{}".format(self.alice.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Alice Title", response.data)
+        self.assertNotIn(b"Peter Title", response.data)
+        # Listing titles never loads the content columns
+        self.assertFalse([statement for statement in self.statements if "content" in statement])
+    
+    def test_unknown_author(self):
+        self.assertEqual(self.client.get("/author/0").status_code, 404)
+    
+    def test_sitemap(self):
+        response = self.client.get("/sitemap.xml")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/xml")
+        self.assertEqual(response.data.count(b"/entry/"), 2)
+        self.assertFalse([statement for statement in self.statements if "content" in statement])
+    
+    def tearDown(self):
+        event.remove(engine, "before_cursor_execute", self.count_statement)
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        session.commit()
+        
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.alice.id)
+            http_session["_fresh"] = True
+    
+    def month_count(self):
+        today = datetime.date.today()
+        month = session.query(EntryMonth).filter_by(year=today.year, month=today.month).first()
+        return month.entry_count if month else 0
+    
+    def test_summary_follows_writes(self):
+        self.client.post("/entry/add", data={"title": "First Title", "content": "Content"})
+        self.client.post("/entry/add", data={"title": "Second Title", "content": "Content"})
+        self.assertEqual(self.month_count(), 2)
+        
+        entry = session.query(Entry).filter_by(title="First Title").one()
+        self.client.get("/entry/{}/delete".format(entry.id))
+        self.assertEqual(self.month_count(), 1)
+    
+    def test_archive_pages(self):
+        self.client.post("/entry/add", data={"title": "First Title", "content": "Content"})
+        today = datetime.date.today()
+        
+        response = self.client.get("/archive")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("{}/{}".format(today.month, today.year).encode("utf-8"), response.data)
+        
+        response = self.client.get("/archive/{}/{}".format(today.year, today.month))
+        self.assertIn(b"First Title", response.data)
+        self.assertEqual(self.client.get("/archive/2016/13").status_code, 404)
+        self.assertEqual(self.client.get("/archive/0/5").status_code, 404)
+        self.assertEqual(self.client.get("/archive/9999/12").status_code, 404)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestFeeds(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        session.add(Entry(title="First Title", content="*Test* <Content>", author=self.alice))
+        session.commit()
+        page_cache.feed_cache.clear()
+        
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self.count_statement)
+    
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    def simulate_login(self):
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.alice.id)
+            http_session["_fresh"] = True
+    
+    def test_feeds(self):
+        for url, mimetype in [("/feed.atom", "application/atom+xml"), ("/feed.rss", "application/rss+xml")]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, mimetype)
+            self.assertIn(b"First Title", response.data)
+            # The entry HTML is escaped inside the XML
+            self.assertIn(b"&lt;em&gt;Test&lt;/em&gt; &amp;lt;Content&amp;gt;", response.data)
+            self.assertTrue(response.headers["ETag"])
+            self.assertNotIn("Last-Modified", response.headers)
+    
+    def test_cached_per_host(self):
+        self.client.get("/feed.atom", headers={"Host": "evil.example"})
+        response = self.client.get("/feed.atom", headers={"Host": "blog.example"})
+        self.assertIn(b"http://blog.example/", response.data)
+        self.assertNotIn(b"evil.example", response.data)
+    
+    def test_cached_until_write(self):
+        etag = self.client.get("/feed.atom").headers["ETag"]
+        
+        # Served from the cache - no queries, and a 304 for a reader which has it already
+        del self.statements[:]
+        response = self.client.get("/feed.atom", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.statements, [])
+        
+        self.simulate_login()
+        self.client.post("/entry/add", data={"title": "New Title", "content": "New Content"})
+        self.assertIn(b"New Title", self.client.get("/feed.atom").data)
+    
+    def tearDown(self):
+        event.remove(engine, "before_cursor_execute", self.count_statement)
+        page_cache.feed_cache.clear()
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestStreamedEntries(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(self.alice)
+        start = datetime.datetime(2016, 1, 1)
+        for i in range(8):
+            session.add(Entry(title="Entry #{}".format(i), content="Content",
+                              author=self.alice, datetime=start + datetime.timedelta(days=i)))
+        session.commit()
+        
+        # Stream anything bigger than 2 entries, so the test doesn't need hundreds
+        self.threshold = app.config["STREAM_THRESHOLD"]
+        app.config["STREAM_THRESHOLD"] = 2
+    
+    def titles(self, data):
+        return [i for i in range(8) if "Entry #{}<".format(i) in data or "Entry #{}\n".format(i) in data]
+    
+    def test_streamed_page(self):
+        response = self.client.get("/page/2?limit=3")
+        self.assertTrue(response.is_streamed)
+        data = response.get_data(as_text=True)
+        self.assertEqual(self.titles(data), [2, 3, 4])
+        # The pager still hands out a cursor for the older entries, worked out after they were streamed
+        self.assertIn("before=", data)
+    
+    def test_streamed_cursor_page(self):
+        first = self.client.get("/?limit=3").get_data(as_text=True)
+        cursor = first.split("before=")[1].split("&")[0].split('"')[0]
+        
+        response = self.client.get("/?limit=3&before=" + cursor)
+        self.assertTrue(response.is_streamed)
+        data = response.get_data(as_text=True)
+        self.assertEqual(self.titles(data), [2, 3, 4])
+        self.assertIn("before=", data)
+        self.assertIn("after=", data)
+    
+    def test_streamed_cursor_page_newest(self):
+        # Same answer as the unstreamed page - nothing is newer than the first entry, so no "Newer" link
+        cursor = "2100-01-01T00:00:00.000000,1"
+        for limit in (3, 1):
+            data = self.client.get("/?limit={}&before={}".format(limit, cursor)).get_data(as_text=True)
+            self.assertNotIn("Newer", data)
+            self.assertIn("before=", data)
+    
+    def tearDown(self):
+        app.config["STREAM_THRESHOLD"] = self.threshold
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestFragmentCache(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        self.entry = Entry(title="Test Title", content="Test Content", author=self.alice)
+        session.add(self.alice)
+        session.add(self.entry)
+        session.commit()
+    
+    def test_fragments_reused(self):
+        self.client.get("/")
+        hits = fragment_cache.stats()["hits"]
+        # The entry page shows the same block as the index, so it's reused rather than rendered again
+        response = self.client.get("/entry/{}".format(self.entry.id))
+        self.assertIn(b"Test Content", response.data)
+        self.assertEqual(fragment_cache.stats()["hits"], hits + 1)
+    
+    def test_changed_entry_rendered_again(self):
+        self.client.get("/")
+        self.entry.content = "Changed Content"
+        session.commit()
+        self.assertIn(b"Changed Content", self.client.get("/").data)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestQueryInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        self.entry = Entry(title="Test Title", content="Test Content", author=self.alice)
+        session.add(self.entry)
+        session.commit()
+        
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self.count_statement)
+    
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    def test_server_timing_counts_queries(self):
+        url = "/entry/{}".format(self.entry.id)
+        del self.statements[:]
+        response = self.client.get(url)
+        timing = response.headers["Server-Timing"]
+        self.assertIn('desc="{} queries"'.format(len(self.statements)), timing)
+        self.assertTrue(timing.startswith("db;dur="))
+    
+    def test_slow_queries_logged(self):
+        app.config["SLOW_QUERY_THRESHOLD_MS"] = 0
+        try:
+            with self.assertLogs("blog.instrumentation", "WARNING") as logs:
+                self.client.get("/entry/{}".format(self.entry.id))
+        finally:
+            app.config["SLOW_QUERY_THRESHOLD_MS"] = 100
+        self.assertIn("FROM entries", logs.output[0])
+    
+    def tearDown(self):
+        event.remove(engine, "before_cursor_execute", self.count_statement)
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        session.add(Entry(title="Test Title", content="Test Content", author=self.alice))
+        session.commit()
+        
+        self.profile_dir = tempfile.mkdtemp()
+        app.config["PROFILE_DIR"] = self.profile_dir
+    
+    def test_token_returns_summary(self):
+        response = self.client.get("/?limit=5&profile={}".format(make_profile_token()))
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertIn(b"cumulative", response.data)
+        self.assertIn(b"GET / - 200 OK", response.data)
+    
+    def test_bad_token_ignored(self):
+        response = self.client.get("/?profile=forged")
+        self.assertEqual(response.mimetype, "text/html")
+        self.assertEqual(os.listdir(self.profile_dir), [])
+    
+    def test_profile_config_writes_files(self):
+        app.config["PROFILE"] = True
+        try:
+            response = self.client.get("/")
+        finally:
+            app.config["PROFILE"] = False
+        self.assertIn(b"Test Content", response.data)
+        files = os.listdir(self.profile_dir)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith("GET.root."))
+    
+    def test_profile_files_not_overwritten(self):
+        app.config["PROFILE"] = True
+        try:
+            self.client.get("/")
+            self.client.get("/")
+        finally:
+            app.config["PROFILE"] = False
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+    
+    def test_profile_dir_must_be_private(self):
+        os.chmod(self.profile_dir, 0o777)
+        app.config["PROFILE"] = True
+        try:
+            # Refused when the profile is saved, after the app has handled the request
+            self.assertRaises(ValueError, self.client.get, "/")
+        finally:
+            app.config["PROFILE"] = False
+    
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+        app.config["PROFILE_DIR"] = ""
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+    
+    def test_requests_counted_per_endpoint(self):
+        self.client.get("/")
+        self.client.get("/entry/1000")
+        data = self.client.get("/metrics").data.decode("utf-8")
+        self.assertIn('blogful_requests_total{endpoint="entries",method="GET",status="200"}', data)
+        self.assertIn('blogful_requests_total{endpoint="view_entry",method="GET",status="404"}', data)
+        self.assertIn('blogful_request_duration_seconds_bucket{endpoint="entries"', data)
+        self.assertIn('blogful_cache{cache="markdown",stat="hits"}', data)
+        self.assertIn('blogful_template_render_seconds_count{template="entries.html"}', data)
+    
+    def test_unhandled_errors_counted(self):
+        def broken():
+            raise RuntimeError("broken")
+        view = app.view_functions["sitemap"]
+        app.view_functions["sitemap"] = broken
+        app.config["PROPAGATE_EXCEPTIONS"] = False
+        try:
+            self.assertEqual(self.client.get("/sitemap.xml").status_code, 500)
+        finally:
+            app.view_functions["sitemap"] = view
+            app.config["PROPAGATE_EXCEPTIONS"] = None
+        data = self.client.get("/metrics").data.decode("utf-8")
+        self.assertIn('blogful_requests_total{endpoint="sitemap",method="GET",status="500"} 1.0', data)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.user = User(name="Alice", email="alice@example.com",
+                        password=generate_password_hash("test"))
+        session.add(self.user)
+        session.commit()
+        user_cache.clear()
+        
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.user.id)
+            http_session["_fresh"] = True
+        
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self.count_statement)
+    
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    def user_queries(self):
+        return len([statement for statement in self.statements if "FROM users" in statement])
+    
+    def test_logged_in_user_cached(self):
+        self.client.get("/")
+        self.assertEqual(self.user_queries(), 1)
+        response = self.client.get("/")
+        self.assertEqual(self.user_queries(), 1)
+        # Still logged in, with the cached user
+        self.assertIn(b"Add Entry", response.data)
+    
+    def test_cached_user_can_add_entries(self):
+        self.client.get("/")
+        self.client.post("/entry/add", data={"title": "Test Entry", "content": "Test Content"})
+        self.assertEqual(session.query(Entry).one().author_id, self.user.id)
+    
+    def test_invalidate_user(self):
+        self.client.get("/")
+        invalidate_user(self.user.id)
+        self.client.get("/")
+        self.assertEqual(self.user_queries(), 2)
+    
+    def tearDown(self):
+        event.remove(engine, "before_cursor_execute", self.count_statement)
+        user_cache.clear()
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestLogin(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        # A hash made with an older, cheaper method than the config's
+        self.user = User(name="Alice", email="alice@example.com",
+                        password=generate_password_hash("test", method="pbkdf2:sha256:1000"))
+        session.add(self.user)
+        session.commit()
+        passwords.failed_logins.clear()
+    
+    def login(self, password):
+        return self.client.post("/login", data={"email": "alice@example.com", "password": password})
+    
+    def test_login_rehashes_password(self):
+        response = self.login("test")
+        self.assertEqual(urlparse(response.location).path, "/")
+        session.refresh(self.user)
+        self.assertTrue(self.user.password.startswith(app.config["PASSWORD_HASH_METHOD"] + "$"))
+        # And the new hash still works
+        self.client.get("/logout")
+        self.assertEqual(urlparse(self.login("test").location).path, "/")
+    
+    def test_failed_logins_rate_limited(self):
+        for i in range(app.config["LOGIN_RATE_LIMIT"]):
+            self.assertEqual(urlparse(self.login("wrong").location).path, "/login")
+        # Even the right password is refused now
+        self.assertEqual(urlparse(self.login("test").location).path, "/login")
+    
+    def tearDown(self):
+        passwords.failed_logins.clear()
+        session.close()
+        Base.metadata.drop_all(engine)
+
+class TestUpdatedAt(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        
+        Base.metadata.create_all(engine)
+        
+        self.alice = User(name="Alice", email="alice@example.com",
+                     password=generate_password_hash("test"))
+        self.edited = datetime.datetime(2016, 1, 1)
+        self.entry = Entry(title="Test Title", content="Test Content", author=self.alice)
+        session.add(self.entry)
+        session.commit()
+        self.entry.updated_at = self.edited
+        session.commit()
+    
+    def test_render_content_keeps_updated_at(self):
+        render_content(rerender=True)
+        session.refresh(self.entry)
+        self.assertEqual(self.entry.content_html, "<p>Test Content</p>\n")
+        self.assertEqual(self.entry.updated_at, self.edited)
+    
+    def test_edit_moves_updated_at(self):
+        self.entry.content = "Changed Content"
+        session.commit()
+        self.assertGreater(self.entry.updated_at, self.edited)
+    
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file